@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+
+# File: benchmark.py
+
+"""
+Usage:
+    ./benchmark.py [-n N] [-s SEED] [-r REPEAT] [-w WORKERS] [-o JSON]
+                   [-b NAME ..]
+
+Times the main paths of the app using synthetic (but, for a
+given seed, always the same) data so no access to the real
+(encrypted) data is needed:
+    import       main.bulk_import of a People csv file
+    get_record   main.get_record of random personIDs
+    index        paging through main.get_index_page
+    letters      letters.letter_text for every record
+    merge_letters  main.mail_merge into one file
+    merge_letters_parallel  the same using WORKERS processes
+    tabulate     helpfuncs.tabulate of all names
+    itabulate    helpfuncs.itabulate of all names (paged)
+    convert      convert_g.converted_contacts of a google csv
+    merge2csv    merge2csv.collect_dict merge of two csv files
+    stream_merge merge2csv.stream_merge of the same two files
+    nway_merge   merge2csv.nway_merge of the same two files
+
+Options:
+    -n N  Number of contacts generated. [default: 10000]
+    -s SEED  Seed for the data generator. [default: 1]
+    -r REPEAT  Each benchmark is run REPEAT times; the
+        fastest is reported. [default: 1]
+    -w WORKERS  Processes used by merge_letters_parallel.
+        [default: the number of CPUs (at least 2)]
+    -o JSON  File to which results are written (as JSON) for
+        comparison between commits. [default: stdout]
+    -b NAME  Run only the named benchmark(s.)
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import main
+import letters
+import helpfuncs
+import convert_g
+import merge2csv
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+people_fields = ("prefix", "first", "initial", "last", "suffix",
+        "company", "phone", "land_line", "mobile", "address",
+        "address1", "town", "state", "postal_code", "country",
+        "email", "birthday", "extra",)
+
+google_fields = ('Name', 'Given Name', 'Additional Name',
+        'Family Name', 'Name Prefix', 'Name Suffix',
+        'Organization 1 - Name', 'Address 1 - Formatted',
+        'Address 1 - Street', 'Address 1 - City',
+        'Address 1 - PO Box', 'Address 1 - Region',
+        'Address 1 - Postal Code', 'Address 1 - Country',
+        'Phone 1 - Type', 'Phone 1 - Value',
+        'Phone 2 - Type', 'Phone 2 - Value',
+        'Phone 3 - Type', 'Phone 3 - Value',
+        'E-mail 1 - Type', 'E-mail 1 - Value',
+        'E-mail 2 - Type', 'E-mail 2 - Value',)
+
+first_names = ('Alex', 'Angie', 'Ann', 'Bob', 'Carol', 'Dave',
+        'Eve', 'Frank', 'Grace', 'Heidi', 'Ivan', 'June', 'Ken',
+        'Lena', 'Mike', 'Nora', 'Omar', 'Peter', 'Rosa', 'Sam',)
+last_names = ('Adams', 'Baker', 'Chavez', 'Dunn', 'Evans',
+        "O'Brien", 'Garcia', 'Hill', 'Ito', 'Jones', 'Kleider',
+        'Lopez', 'Moore', 'Nguyen', 'Smith', 'Tanaka', 'Wong',)
+towns = (('Bolinas', 'CA', '94924'), ('Stinson Beach', 'CA', '94970'),
+         ('Point Reyes', 'CA', '94956'), ('Portland', 'OR', '97201'),
+         ('Seattle', 'WA', '98101'),)
+streets = ('Main St', 'Mesa Rd', 'Wharf Rd', 'Elm Ave', 'Ocean Pkwy')
+
+
+def fake_contact(rnd, i):
+    """
+    Returns a dict keyed by people_fields. The <i>th contact
+    gets a unique first name so that name keys don't collide.
+    """
+    town, state, postal_code = rnd.choice(towns)
+    first = "{}{}".format(rnd.choice(first_names), i)
+    last = rnd.choice(last_names)
+    return dict(
+        prefix=rnd.choice(('', '', 'Mr', 'Ms', 'Dr')),
+        first=first,
+        initial=rnd.choice(('', 'A', 'J')),
+        last=last,
+        suffix=rnd.choice(('', '', '', 'Jr')),
+        company=rnd.choice(('', '', 'Acme Inc')),
+        phone="415-{:03}-{:04}".format(rnd.randrange(1000),
+                                       rnd.randrange(10000)),
+        land_line='', mobile='',
+        address="{} {}".format(rnd.randrange(1, 999),
+                               rnd.choice(streets)),
+        address1=rnd.choice(('', '', 'PO Box 12')),
+        town=town, state=state, postal_code=postal_code,
+        country=rnd.choice(('', 'USA')),
+        email="{}.{}@example.com".format(first, last).lower(),
+        birthday='', extra='',
+        )
+
+
+def write_people_csv(file_name, n, seed=1):
+    """
+    Writes <n> contacts in the format main.initiate_db_cmd
+    expects.
+    """
+    rnd = random.Random(seed)
+    with open(file_name, 'w', newline='') as outstream:
+        writer = csv.DictWriter(outstream, fieldnames=people_fields)
+        writer.writeheader()
+        for i in range(n):
+            writer.writerow(fake_contact(rnd, i))
+
+
+def write_google_csv(file_name, n, seed=1):
+    """
+    Writes <n> contacts in the format of a google contacts
+    export (including multi-line quoted fields.)
+    """
+    rnd = random.Random(seed)
+    with open(file_name, 'w', newline='') as outstream:
+        writer = csv.writer(outstream)
+        writer.writerow(google_fields)
+        for i in range(n):
+            c = fake_contact(rnd, i)
+            formatted = "{address}\n{town}, {state} {postal_code}".format(
+                    **c)
+            writer.writerow((
+                "{first} {last}".format(**c), c['first'], c['initial'],
+                c['last'], c['prefix'], c['suffix'], c['company'],
+                formatted, c['address'], c['town'], c['address1'],
+                c['state'], c['postal_code'], c['country'],
+                '* Mobile', c['phone'],
+                'Home' if i % 3 else '', '415-555-0100' if i % 3 else '',
+                '', '',
+                '* Home', c['email'],
+                '', 'other@example.com' if i % 5 == 0 else '',
+                ))
+
+
+def timed(func, repeat=1):
+    """
+    Returns the shortest time (in seconds) taken by <func>()
+    in <repeat> calls, and what the last call returned.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ret = func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, ret
+
+
+class Bench(object):
+    """
+    The data (in a temporary directory) and the benchmarks.
+    Each bench_<name> method returns a function which, when
+    called, does the work to be timed and returns the number
+    of items (records, letters, ...) processed.
+    """
+
+    def __init__(self, tmp_dir, n, seed=1, workers=2):
+        self.tmp_dir = tmp_dir
+        self.n = n
+        self.seed = seed
+        self.workers = workers
+        self.people_csv = os.path.join(tmp_dir, 'people.csv')
+        self.people2_csv = os.path.join(tmp_dir, 'people2.csv')
+        self.google_csv = os.path.join(tmp_dir, 'google.csv')
+        write_people_csv(self.people_csv, n, seed)
+        # an overlapping second file for the merges
+        write_people_csv(self.people2_csv, n, seed + 1)
+        write_google_csv(self.google_csv, n, seed)
+        main.db_file_name = os.path.join(tmp_dir, 'contacts.sqldb')
+        main.creation_script = os.path.join(here, 'creation_script.sql')
+        self.fresh_db()
+        main.bulk_import(main.get_session().connection,
+                         self.people_csv, report=False)
+
+    def fresh_db(self):
+        main.close_session()
+        if os.path.exists(main.db_file_name):
+            os.remove(main.db_file_name)
+        main.get_session().ensure_schema()
+
+    def bench_import(self):
+        def run():
+            self.fresh_db()
+            return main.bulk_import(main.get_session().connection,
+                                    self.people_csv, report=False)
+        return run
+
+    def bench_get_record(self):
+        rnd = random.Random(self.seed)
+        ids = [rnd.randint(1, self.n) for _ in range(min(self.n, 10000))]
+
+        def run():
+            for personID in ids:
+                main.get_record(personID)
+            return len(ids)
+        return run
+
+    def bench_index(self):
+        def run():
+            n = 0
+            page = main.get_index_page()
+            while page:
+                n += len(page)
+                page = main.get_index_page(
+                        key=(page[-1][3], page[-1][0]))
+            return n
+        return run
+
+    def bench_letters(self):
+        sender = main.get_record(1)
+        recipients = list(main.select_records())
+        lpr = letters.printers['X6505_e9']
+
+        def run():
+            for recipient in recipients:
+                letters.letter_text("Body of the letter.\n",
+                                    recipient, sender, lpr)
+            return len(recipients)
+        return run
+
+    def bench_merge_letters(self):
+        sink = os.path.join(self.tmp_dir, 'mailing.txt')
+
+        def run():
+            return main.mail_merge(1, "Body of the letter.\n",
+                    sink=sink, combined=True, report=False)
+        return run
+
+    def bench_merge_letters_parallel(self):
+        sink = os.path.join(self.tmp_dir, 'mailing.txt')
+
+        def run():
+            return main.mail_merge(1, "Body of the letter.\n",
+                    sink=sink, combined=True, workers=self.workers,
+                    report=False)
+        return run
+
+    def bench_tabulate(self):
+        names = ["{} {}".format(first, last) for _, first, last
+                 in main.get_IDs_w_names()]
+
+        def run():
+            return len(helpfuncs.tabulate(names, max_width=80))
+        return run
+
+    def bench_itabulate(self):
+        names = ["{} {}".format(first, last) for _, first, last
+                 in main.get_IDs_w_names()]
+
+        def run():
+            n = 0
+            for _ in helpfuncs.itabulate(names, max_width=80,
+                                         page_length=20):
+                n += 1
+            return n
+        return run
+
+    def bench_convert(self):
+        def run():
+            n = 0
+            for _ in convert_g.converted_contacts(self.google_csv):
+                n += 1
+            return n
+        return run
+
+    def bench_merge2csv(self):
+        new_csv = os.path.join(self.tmp_dir, 'merged.csv')
+
+        def run():
+            new_dict = merge2csv.collect_dict(self.people_csv,
+                                              people_fields)
+            new_dict.update(merge2csv.collect_dict(self.people2_csv,
+                                                   people_fields))
+            merge2csv.populate_csv_file(new_csv, people_fields,
+                                        new_dict)
+            return len(new_dict)
+        return run
+
+    def bench_stream_merge(self):
+        new_csv = os.path.join(self.tmp_dir, 'merged.csv')
+
+        def run():
+            return merge2csv.stream_merge(
+                    (self.people_csv, self.people2_csv),
+                    people_fields, new_csv)
+        return run
+
+    def bench_nway_merge(self):
+        new_csv = os.path.join(self.tmp_dir, 'merged.csv')
+
+        def run():
+            return merge2csv.nway_merge(
+                    (self.people_csv, self.people2_csv),
+                    people_fields, new_csv)[0]
+        return run
+
+
+benchmarks = ('import', 'get_record', 'index', 'letters',
+              'merge_letters', 'merge_letters_parallel', 'tabulate',
+              'itabulate', 'convert', 'merge2csv', 'stream_merge',
+              'nway_merge',)
+
+
+def get_commit():
+    try:
+        return subprocess.run(('git', 'rev-parse', '--short', 'HEAD'),
+                cwd=here, capture_output=True, text=True,
+                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(n, seed=1, repeat=1, names=benchmarks, workers=2):
+    """
+    Returns a dict (suitable for JSON) of the results of
+    running the benchmarks <names> on <n> contacts.
+    """
+    results = dict()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bench = Bench(tmp_dir, n, seed, workers=workers)
+        for name in names:
+            run = getattr(bench, 'bench_' + name)()
+            seconds, items = timed(run, repeat)
+            results[name] = dict(seconds=round(seconds, 6),
+                    items=items,
+                    per_second=round(items / seconds, 1)
+                               if seconds else None)
+            print("{:22} {:10.3f}s {:9} items {:12.0f}/s".format(
+                  name, seconds, items,
+                  items / seconds if seconds else 0),
+                  file=sys.stderr)
+        main.close_session()
+    return dict(
+        meta=dict(n=n, seed=seed, repeat=repeat, workers=workers,
+                  commit=get_commit(),
+                  time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                  python=platform.python_version(),
+                  sqlite=sqlite3.sqlite_version,
+                  machine=platform.machine()),
+        results=results)
+
+
+def cli():
+    parser = argparse.ArgumentParser(usage=__doc__)
+    parser.add_argument('-n', type=int, default=10000)
+    parser.add_argument('-s', type=int, default=1)
+    parser.add_argument('-r', type=int, default=1)
+    parser.add_argument('-w', type=int,
+                        default=max(2, os.cpu_count() or 1))
+    parser.add_argument('-o')
+    parser.add_argument('-b', nargs='+', choices=benchmarks,
+                        default=benchmarks)
+    args = parser.parse_args()
+    res = run_benchmarks(args.n, seed=args.s, repeat=args.r,
+                         names=args.b, workers=args.w)
+    if args.o:
+        with open(args.o, 'w') as outstream:
+            json.dump(res, outstream, indent=2)
+    else:
+        json.dump(res, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    cli()
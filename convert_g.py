@@ -8,12 +8,25 @@ Input and output files are hard coded (and could easily
 be changed.)
 A changing of "my csv" format[1] would require more editing.
 [1] "my csv" format is expressed by the 'my_fields' tuple.
+
+Usage:
+    ./convert_g.py [-w N]
+Option -w N: share the conversion among N processes, each of
+which reads and converts its own pieces of the file.
 """
 
+import io
+import os
 import csv
+import shutil
+import argparse
+import tempfile
+import collections
+import multiprocessing
 
 output_csv = "Data/my_google.csv"
 google_csv = 'Data/google.csv'
+piece_size = 4 << 20  # bytes per job when converting in parallel
 
 my_fields = ("prefix","first","initial","last","suffix","company",
             "phone","address","address1","town","state",
@@ -41,58 +54,205 @@ phone_fields = (
 email_fields = ('E-mail 1 - Value', 'E-mail 2 - Value') 
 
 
-def complete_record(collected_fields):
-    ret = {}
-    collected_keys = collected_fields.keys()
-    for key in my_fields:
-        if key in collected_keys:
-            ret[key] = collected_fields[key]
-        else:
-            ret[key] = ''
+def compile_mapping(header):
+    """
+    Returns the google to "my csv" mapping worked out (once)
+    for a file with the given <header> (list of field names)
+    as a tuple of column positions:
+    (fields, phones, emails, phone, email) where
+        <fields> is a tuple of (google, mine) position pairs,
+        <phones> of (value, type) positions of phone numbers,
+        <emails> of positions of e-mail addresses,
+        <phone> and <email> are positions in my_fields.
+    Fields not in my_fields (ie 'middle') are left out.
+    """
+    position = {name: i for i, name in enumerate(header)}
+    mine = {name: i for i, name in enumerate(my_fields)}
+    fields = tuple((position[g], mine[m])
+                   for g, m in corresponding_fields if m in mine)
+    phones = tuple((position['Phone {} - Value'.format(n)],
+                    position['Phone {} - Type'.format(n)])
+                   for n in (1, 2, 3))
+    emails = tuple(position['E-mail {} - Value'.format(n)]
+                   for n in (1, 2))
+    return (fields, phones, emails, mine['phone'], mine['email'])
+
+
+def convert_row(row, mapping):
+    """
+    Returns a list of values (in the order of my_fields)
+    from <row>, a list of values of a google csv file.
+    <mapping> is provided by compile_mapping.
+    """
+    fields, phones, emails, phone, email = mapping
+    ret = [''] * len(my_fields)
+    for g, m in fields:
+        ret[m] = row[g]
+    ret[phone] = ' '.join(['{}({})'.format(row[v], row[t])
+                           for v, t in phones if row[v]])
+    ret[email] = ' '.join([row[e].strip()
+                           for e in emails if row[e]])
     return ret
 
 
-def converted_contacts(google_csv):
+def pad(rows, n_fields):
+    """
+    'yield's each of <rows>, padded to <n_fields> values
+    if short (where DictReader would give None.)
+    """
+    for row in rows:
+        if len(row) < n_fields:
+            row = row + [''] * (n_fields - len(row))
+        yield row
+
+
+def split_rows(file_name, n_pieces):
+    """
+    Returns a list of the byte offsets of (up to) <n_pieces>
+    + 1 row boundaries in csv file <file_name>: the start of
+    the first row after the header, the starts of rows which
+    divide the rest into pieces of about the same size, and
+    the end of the file.
+    A newline ends a row unless it's within quotes, ie unless
+    an odd number of quote characters come before it (a quote
+    within a quoted field is doubled so doesn't change that);
+    so only quotes need to be counted, not the csv parsed.
+    """
+    size = os.path.getsize(file_name)
+    offsets = []
+    with open(file_name, 'rb') as instream:
+        position = 0
+        quotes = 0  # number of quote characters before position
+        for target in [size * i // n_pieces for i in range(n_pieces)]:
+            while position < target:
+                block = instream.read(min(1 << 20, target - position))
+                position += len(block)
+                quotes += block.count(b'"')
+            while True:  # to the end of the row
+                line = instream.readline()
+                position += len(line)
+                quotes += line.count(b'"')
+                if not line or not quotes % 2:
+                    break
+            if not offsets or position > offsets[-1]:
+                offsets.append(position)
+    if offsets[-1] < size:
+        offsets.append(size)
+    return offsets
+
+
+def convert_piece(job):
+    """
+    Worker function (see converted_rows and main) which
+    reads, parses and converts the rows of a piece of a google
+    csv file: (<length> bytes from <offset>.) <job> is a tuple:
+    (google_csv, offset, length, n_fields, mapping, output).
+    If <output> is a file name, the converted rows of contacts
+    with an address are written (as csv, as main does) to it
+    and their number is returned; otherwise a list of all the
+    converted rows is.
+    """
+    google_csv, offset, length, n_fields, mapping, output = job
+    with open(google_csv, 'rb') as instream:
+        instream.seek(offset)
+        data = instream.read(length)
+    # (decoded as open() would have)
+    rows = pad(csv.reader(io.TextIOWrapper(io.BytesIO(data),
+                                           newline='')), n_fields)
+    if output is None:
+        return [convert_row(row, mapping) for row in rows]
+    address = my_fields.index("address")
+    n_rows = 0
+    with open(output, 'w', newline='') as outstream:
+        writer = csv.writer(outstream, lineterminator='\n')
+        for row in rows:
+            values = convert_row(row, mapping)
+            if values[address]:
+                writer.writerow(values)
+                n_rows += 1
+    return n_rows
+
+
+def get_jobs(google_csv, workers, outputs=None):
+    """
+    Returns a list of jobs (see convert_piece) which divide
+    the rows of <google_csv> into pieces of about piece_size
+    bytes (but at least one for each of <workers>.)
+    <outputs>, if provided, is a function returning the
+    output file name for the <n>th piece.
+    """
     with open(google_csv, 'r', newline='') as instream:
-        reader = csv.DictReader(instream)
-        fieldnames = reader.fieldnames
-        for row in reader:
-            keep = False
-            new_record = {}
-            for g, m in corresponding_fields:
-                if row[g]:
-                    new_record[m] = row[g]
-            myphone_field = []
-            for n in (1,2,3):
-                p_key = 'Phone {} - Value'.format(n)
-                t_key = 'Phone {} - Type'.format(n)
-                if row[p_key]:
-                    phone_number = row[p_key]
-                    phone_number = (phone_number +
-                    '({})'.format(row[t_key]))
-                    myphone_field.append(phone_number)
-            new_record['phone'] = ' '.join(myphone_field)
-            email_field = []
-            for n in (1,2):
-                e_key = 'E-mail {} - Value'.format(n)
-                if row[e_key]:
-                    email_field.append(row[e_key].strip())
-            new_record['email'] = ' '.join(email_field)
-            yield complete_record(new_record)
+        header = next(csv.reader(instream))
+    mapping = compile_mapping(header)
+    offsets = split_rows(google_csv, max(workers,
+            os.path.getsize(google_csv) // piece_size))
+    return [(google_csv, start, end - start, len(header), mapping,
+             outputs(n) if outputs else None)
+            for n, (start, end)
+            in enumerate(zip(offsets, offsets[1:]))]
 
 
+def converted_rows(google_csv, workers=1):
+    """
+    'yield's lists of values (in the order of my_fields,)
+    one for each contact in <google_csv>, in order.
+    If <workers> is more than 1, the file is divided (see
+    get_jobs) among that many processes each of which reads,
+    parses and converts its own pieces; no more than two
+    pieces per worker are outstanding at a time.
+    """
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            pending = collections.deque()
+            for job in get_jobs(google_csv, workers):
+                pending.append(pool.apply_async(convert_piece,
+                                                (job, )))
+                if len(pending) >= 2 * workers:
+                    yield from pending.popleft().get()
+            while pending:
+                yield from pending.popleft().get()
+        return
+    with open(google_csv, 'r', newline='') as instream:
+        reader = csv.reader(instream)
+        header = next(reader)
+        mapping = compile_mapping(header)
+        for row in pad(reader, len(header)):
+            yield convert_row(row, mapping)
+
+
+def converted_contacts(google_csv, workers=1):
+    """
+    'yield's a record (dict keyed by my_fields) for
+    each contact in <google_csv>.
+    """
+    for values in converted_rows(google_csv, workers=workers):
+        yield dict(zip(my_fields, values))
+
 
 def main():
+    parser = argparse.ArgumentParser(usage=__doc__)
+    parser.add_argument('-w', type=int, default=1)
+    args = parser.parse_args()
+    address = my_fields.index("address")
     with open(output_csv, 'w', newline='') as outstream:
-        writer = csv.DictWriter(outstream,
-                fieldnames=my_fields,
-          lineterminator='\n')
-
-        writer.writeheader()
-        for new_record in converted_contacts(google_csv):
-#           _ = input(new_record)
-            if new_record["address"]:
-                writer.writerow(new_record)
+        writer = csv.writer(outstream, lineterminator='\n')
+        writer.writerow(my_fields)
+        if args.w <= 1:
+            for values in converted_rows(google_csv):
+                if values[address]:
+                    writer.writerow(values)
+            return
+        # each worker writes its own piece; these are then joined
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            jobs = get_jobs(google_csv, args.w, outputs=lambda n:
+                            os.path.join(tmp_dir, f"{n}.csv"))
+            with multiprocessing.Pool(args.w) as pool:
+                pool.map(convert_piece, jobs)
+            outstream.flush()
+            for job in jobs:
+                with open(job[-1], 'r', newline='') as instream:
+                    shutil.copyfileobj(instream, outstream)
+
 
 if __name__ == '__main__':
     main()
@@ -2,7 +2,7 @@
 -- Suggest use contacts.sqldb
 
 DROP TABLE IF EXISTS Contacts;
-CREATE TABLE People (
+CREATE TABLE IF NOT EXISTS People (
     personID INTEGER PRIMARY KEY,
     prefix TEXT DEFAULT '',
     first TEXT DEFAULT '',
@@ -24,4 +24,69 @@ CREATE TABLE People (
     extra TEXT DEFAULT ''
     );
 
+-- Natural key and content hash of records (see main.sync)
+CREATE TABLE IF NOT EXISTS SyncState (
+    personID INTEGER PRIMARY KEY,
+    natural_key TEXT UNIQUE,
+    content_hash TEXT
+    );
 
+-- Derived columns, computed by sqlite rather than by python:
+-- full_name and full_address as letters.full_name and
+-- letters.address_template would have them; sort_name orders
+-- the (keyset paged) index.  (ALTER TABLE rather than in CREATE
+-- TABLE so that an existing data base gets them too; 'duplicate
+-- column' errors are ignored by main.Session.ensure_schema.)
+ALTER TABLE People ADD COLUMN full_name TEXT GENERATED ALWAYS AS (
+    rtrim(iif(prefix <> '', prefix || ' ', '')
+        || iif(first <> '', first || ' ', '')
+        || iif(initial <> '', initial || ' ', '')
+        || iif(last <> '', last || ' ', '')
+        || iif(suffix <> '', suffix || ' ', ''), ' ')
+    ) VIRTUAL;
+ALTER TABLE People ADD COLUMN full_address TEXT GENERATED ALWAYS AS (
+    full_name || ',' || char(10)
+    || ifnull(address, '') || char(10)
+    || ifnull(town, '') || ', ' || ifnull(state, '') || ' '
+    || ifnull(postal_code, '') || char(10)
+    || ifnull(country, '')
+    ) VIRTUAL;
+ALTER TABLE People ADD COLUMN sort_name TEXT GENERATED ALWAYS AS (
+    lower(last) || ', ' || lower(first)
+    ) VIRTUAL;
+CREATE INDEX IF NOT EXISTS People_sort_name ON People (sort_name);
+-- (replaces the People_names index of earlier versions)
+DROP INDEX IF EXISTS People_names;
+
+-- Full text search (see main.search) of People, kept in sync by
+-- triggers. External content: People_fts stores only the index.
+CREATE VIRTUAL TABLE IF NOT EXISTS People_fts USING fts5(
+    first, last, company, town, email, extra,
+    content='People', content_rowid='personID',
+    prefix='2 3'
+    );
+CREATE TRIGGER IF NOT EXISTS People_fts_insert
+    AFTER INSERT ON People BEGIN
+    INSERT INTO People_fts (rowid, first, last, company,
+            town, email, extra)
+        VALUES (new.personID, new.first, new.last, new.company,
+            new.town, new.email, new.extra);
+END;
+CREATE TRIGGER IF NOT EXISTS People_fts_delete
+    AFTER DELETE ON People BEGIN
+    INSERT INTO People_fts (People_fts, rowid, first, last,
+            company, town, email, extra)
+        VALUES ('delete', old.personID, old.first, old.last,
+            old.company, old.town, old.email, old.extra);
+END;
+CREATE TRIGGER IF NOT EXISTS People_fts_update
+    AFTER UPDATE ON People BEGIN
+    INSERT INTO People_fts (People_fts, rowid, first, last,
+            company, town, email, extra)
+        VALUES ('delete', old.personID, old.first, old.last,
+            old.company, old.town, old.email, old.extra);
+    INSERT INTO People_fts (rowid, first, last, company,
+            town, email, extra)
+        VALUES (new.personID, new.first, new.last, new.company,
+            new.town, new.email, new.extra);
+END;
@@ -8,6 +8,7 @@ A slimmed down version of helpers.py
 
 import os
 import datetime
+import itertools
 import functools
 
 date_template = "%b %d, %Y"
@@ -187,10 +188,38 @@ def useful_lines(stream, comment="#"):
             yield line
 
 
+def batches(iterable, size):
+    """
+    A generator which 'yield's lists of (at most) <size> items
+    taken from <iterable>; only one batch is in memory at a time.
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def padding(k, n):
+    """
+    Returns the number of blank lines needed before and after
+    <k> lines of content to center it in <n> lines. If an odd
+    number of blanks is needed, the odd one is at the end.
+    """
+    if k > n:
+        print("ERROR: too many lines in <content>")
+        print("    parameter of helpers.expand_array()!")
+        assert False
+    lead = (n - k) // 2
+    return lead, n - k - lead
+
+
 def expand_string(content, n):
-    a = content.split('\n')
-    ret = expand_array(a, n)
-    return '\n'.join(ret)
+    lead, trail = padding(content.count('\n') + 1, n)
+    return '\n' * lead + content + '\n' * trail
 
 
 def expand_array(content, n):
@@ -199,17 +228,23 @@ def expand_array(content, n):
     Returns a sequence of n itmes by padding both ends with empty
     strings.
     """
-    if len(content) > n:
-        print("ERROR: too many lines in <content>")
-        print("    parameter of helpers.expand_array()!")
-        assert False
-    a = [item for item in content]
-    while n > len(a):
-        if n - len(a) >= 2:
-            a = [''] + a + ['']
-        else:
-            a.append('')
-    return a
+    content = list(content)
+    lead, trail = padding(len(content), n)
+    return [''] * lead + content + [''] * trail
+
+
+def expand_into(out, content, nlines):
+    """
+    Like expand (but <content> must be a string) except that
+    the result is written to <out> (anything with a 'write'
+    method: a file, io.StringIO, ...) rather than returned.
+    Every line written (including the last) ends with a line
+    feed so what follows starts on a new line.
+    """
+    lead, trail = padding(content.count('\n') + 1, nlines)
+    out.write('\n' * lead)
+    out.write(content)
+    out.write('\n' * (trail + 1))
 
 
 def expand(content, nlines):
@@ -347,12 +382,72 @@ def tabulate(data,
         row.append(appendee)
     if row:
         new_data.append(separator.join(row))
-    while not new_data[0]:
-        new_data = new_data[1:]
-    new_data = [item.strip() for item in new_data]
+    first = 0
+    while not new_data[first]:
+        first += 1
+    new_data = [item.strip() for item in new_data[first:]]
     return new_data
 
 
+def itabulate(data,
+              display=None,   # a function
+              alignment='<',  # left (<), right (>) or centered (^)
+              down=True,  # list by column (down) or by row
+              max_width=145,
+              separator=' | ',  # minimum separation between columns
+              width=None,  # expected length of longest element
+              sample=100,  # n elements used to estimate <width>
+              page_length=0):
+    """
+    A generator version of tabulate (with fewer options) for
+    long listings: rows (strings) are 'yield'ed as they are
+    ready rather than all being returned at the end.
+    The number of columns is decided by <width> (the length
+    expected of the longest element) or, if it's not provided,
+    by the longest of the first <sample> elements. (A longer
+    element later on will just push its row out of line.)
+    Each column is only as wide as its own longest element.
+    If <page_length> is set, <data> is consumed a page (that
+    many rows) at a time, the layout (by column if <down>) is
+    done for each page and only one page is ever in memory;
+    so the caller can pause every <page_length> rows.
+    Otherwise all of <data> is one page.
+    """
+    if alignment not in ('<', '^', '>'):
+        raise ValueError(
+            "Alignmemt specifier not valid: choose from '<', '^', '>'")
+    items = iter(data) if display is None else map(display, data)
+    if width is None:
+        head = list(itertools.islice(items, sample))
+        if not head:
+            return
+        width = max(len(item) for item in head)
+        items = itertools.chain(head, items)
+    n_per_line = max(1,
+            (max_width + len(separator)) // (width + len(separator)))
+    if page_length:
+        pages = batches(items, page_length * n_per_line)
+    else:
+        pages = (list(items), )
+    for page in pages:
+        if not page:  # (data was empty)
+            continue
+        n_rows = -(-len(page) // n_per_line)  # rounding up
+        if down:
+            columns = [page[i:i + n_rows]
+                       for i in range(0, len(page), n_rows)]
+        else:
+            columns = [page[i::n_per_line]
+                       for i in range(min(n_per_line, len(page)))]
+        widths = [max(len(item) for item in column)
+                  for column in columns]
+        for j in range(n_rows):
+            yield separator.join(
+                ['{:{}{}}'.format(column[j], alignment, w)
+                 for column, w in zip(columns, widths)
+                 if j < len(column)]).rstrip()
+
+
 if __name__ == "__main__":
     print(get_os_release())
 
@@ -9,6 +9,7 @@ A module to support main.py (prepare mailing utility.)
 A number of 'dict's are being used:
     letter_bodies
     printers: X6505, HL2170, ...
+    _layouts: printers compiled into Layout objects.
 
 Other items:
     func: prepare_letter_template(which_letter, printer):
@@ -17,17 +18,32 @@ re printers: Both printer model and windowed
 envelope size must be taken into consideration.
 """
 
+import io
 import csv
 import helpfuncs
 
 
-def add_full_name(record):
+address_template = """{full_name},
+{address}
+{town}, {state} {postal_code}
+{country}"""
+
+
+def full_name(record):
+    """
+    Returns <record>'s name: whichever of its prefix, first,
+    initial, last and suffix fields are not empty.
+    """
     parts = []
     keys = record.keys()
     for key in ('prefix', 'first', 'initial', 'last', 'suffix'):
         if key in keys and record[key]:
             parts.append(record[key])
-    record['full_name'] = ' '.join(parts)
+    return ' '.join(parts)
+
+
+def add_full_name(record):
+    record['full_name'] = full_name(record)
 
 
 def add_name4presentation(record, formality=0):
@@ -41,11 +57,16 @@ def add_name4presentation(record, formality=0):
 
 
 def full_address(record):
-    add_full_name(record)
-    return """{full_name},
-{address}
-{town}, {state} {postal_code}
-{country}""".format(**record)
+    """
+    Returns <record>'s name and address (as for an envelope.)
+    Records which keep their own (ie main.Contact) are asked
+    for it rather than having it worked out again.
+    """
+    try:
+        return record.full_address
+    except AttributeError:
+        add_full_name(record)
+        return address_template.format_map(record)
 
 
 letter_bodies_docstring = """
@@ -108,6 +129,111 @@ printers = dict(
 # ## ... end of printers (dict specifying printer being used.)
 
 
+class Layout(object):
+    """
+    A printer specification (a value of <printers>) compiled
+    into the strings of line feeds needed to position each
+    part of a letter so that rendering a letter is no more
+    than joining strings.
+    Use get_layout() to get the (cached) layout of a printer.
+    """
+
+    slots = ('frm', 'date', 'to', 're')
+
+    def __init__(self, lpr):
+        self.lpr = lpr
+        self.top = '\n' * lpr['top']
+        # For each slot: self.pads[slot][k] is the leading and
+        # trailing line feeds needed to center k lines of
+        # content (as helpfuncs.expand would) and end the slot.
+        self.lines = dict()
+        self.pads = dict()
+        for slot in self.slots:
+            n = lpr[slot]
+            if isinstance(n, tuple):  # (lines, width) of window
+                n = n[0]
+            self.lines[slot] = n
+            pads = [None]
+            for k in range(1, n + 1):
+                lead, trail = helpfuncs.padding(k, n)
+                pads.append(('\n' * lead, '\n' * (trail + 1)))
+            self.pads[slot] = pads
+
+    def place(self, out, slot, text):
+        """
+        Writes <text> to <out> padded to fill the lines of <slot>.
+        """
+        pads = self.pads[slot]
+        k = text.count('\n') + 1
+        if k >= len(pads):  # too many lines: let padding complain
+            helpfuncs.expand_into(out, text, self.lines[slot])
+            return
+        lead, trail = pads[k]
+        out.write(lead)
+        out.write(text)
+        out.write(trail)
+
+    def render_into(self, out, letter_body, recipient, sender,
+                    formality=0, date=None):
+        """
+        Writes the letter (same as letter_text would return)
+        to <out> which can be a file or an io.StringIO.
+        <date> defaults to today's date stamp.
+        """
+        return_address = full_address(sender)
+        destination_address = full_address(recipient)
+        add_name4presentation(recipient, formality=formality)
+        add_name4presentation(sender, formality=formality)
+        if date is None:
+            date = helpfuncs.get_datestamp()
+        out.write(self.top)
+        self.place(out, 'frm', return_address)
+        self.place(out, 'date', date)
+        self.place(out, 'to', destination_address)
+        self.place(out, 're', '')  # subject/Re: line
+        out.write(f"Dear {recipient['name4presentation']},\n\n")
+        out.write(letter_body)
+        if not formality:
+            out.write('\n\t\t\t\tSincerely,\n\t\t\t\t')
+        else:
+            out.write('\n\t\t\t\tYours truely,\n\t\t\t\t')
+        out.write(sender['name4presentation'])
+
+    def render(self, letter_body, recipient, sender,
+               formality=0, date=None):
+        """
+        Returns the letter (same as letter_text would.)
+        """
+        out = io.StringIO()
+        self.render_into(out, letter_body, recipient, sender,
+                         formality=formality, date=date)
+        return out.getvalue()
+
+
+_layouts = dict()  # Layouts keyed by printer name
+
+
+def get_layout(printer):
+    """
+    Returns the Layout for <printer> which may be one of the
+    keys of <printers>, one of its values, or a Layout (which
+    is returned as is.) Compiled layouts of known printers
+    are cached (by name) so each is compiled only once.
+    """
+    if isinstance(printer, Layout):
+        return printer
+    if not isinstance(printer, str):
+        for name, lpr in printers.items():
+            if lpr is printer:
+                printer = name
+                break
+        else:  # not one of ours so can't be cached
+            return Layout(printer)
+    if printer not in _layouts:
+        _layouts[printer] = Layout(printers[printer])
+    return _layouts[printer]
+
+
 def get_postscripts(which_letter):
     """
     Returns a list of lines representing the post scripts
@@ -125,31 +251,11 @@ def letter_text(letter_body, recipient, sender,
                             formality=0):
     """
     Prepares and returns the letter.
+    <lpr> may be a printer name, specification or Layout
+    (see get_layout.)
     """
-    return_address = full_address(sender)
-    destination_address = full_address(recipient)
-    add_name4presentation(recipient, formality=formality)
-    add_name4presentation(sender, formality=formality)
-    ret = [""] * lpr["top"]  # add blank lines at top
-    ret.append(helpfuncs.expand(return_address, lpr['frm'][0]))
-    ret.append(helpfuncs.expand(
-            (helpfuncs.get_datestamp()), lpr['date']))
-    ret.append(helpfuncs.expand(destination_address,
-                                            lpr['to'][0]))
-    # subject/Re: line
-    ret.append(helpfuncs.expand('', lpr['re']))
-    # salutation:
-    ret.append(f"Dear {recipient['name4presentation']},\n")
-    # body of letter (with or without {extra}(s))
-    ret.append(letter_body)
-    # signarue:
-    if not formality:
-        ret.append('\t\t\t\tSincerely,')
-    else:
-        ret.append('\t\t\t\tYours truely,')
-    ret.append(f"\t\t\t\t{sender['name4presentation']}")
-
-    return '\n'.join(ret)
+    return get_layout(lpr).render(letter_body, recipient,
+                                  sender, formality=formality)
 
 
 def main():
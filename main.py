@@ -9,34 +9,797 @@ Can initiate data from any csv file that does not have any
 field names not contained in the <creation_script> file.
 
 Note: access to original source
+
+Run without a command for the interactive menu; commands
+(import, sync, search, show, render, export: see --help)
+run without prompting so can be used from scripts.
 """
 
 import os
+import re
 import sys
 import csv
+import time
+import queue
+import json
+import pstats
+import cProfile
+import hashlib
+import argparse
+import tracemalloc
+import atexit
+import shutil
+import pathlib
+import tempfile
 import sqlite3
+import threading
+import contextlib
+import itertools
+import collections
+import multiprocessing
 d, f = os.path.split(sys.path[0])
 d, f = os.path.split(d)
 sys.path.insert(0, d)
 # print(sys.path)
 
 import letters
-import content
+import helpfuncs
+import convert_g
 
 db_file_name = 'Data/contacts.sqldb'
 source_csv = 'Data/new.csv'
 source_csv = 'Data/my-old.csv'
 creation_script = 'creation_script.sql'
 test_letter = 'Data/test_letter.txt'
+import_batch_size = 1000  # records per executemany when importing
+fetch_batch_size = 500  # rows per fetchmany when streaming records
+mailing_dir = 'Data/mailing'
+screen_width = 80
+index_page_size = 60  # entries per page of the index
+record_cache_size = 256  # records kept by Session.record
 
 insert_template = """INSERT INTO {table} ({keys})
     VALUES ({values});"""
 
+# The statements used for routine access to People.  Each is
+# formatted (see Session.statement) once per schema and always
+# executed with parameters ('?'s) so that repeated use is served
+# by the sqlite3 module's statement cache.
+# {columns}: all columns but personID (and the derived ones,)
+# {derived}: the derived (generated) columns (each preceded by
+# ', '), {placeholders}: a '?' for each of {columns} and
+# {assignments}: "column = ?" for each of them.
+statement_templates = dict(
+    select_record="""SELECT {columns}{derived} FROM People
+        WHERE personID = ?""",
+    select_records="""SELECT personID, {columns}{derived}
+        FROM People""",
+    select_records_in="""SELECT personID, {columns}{derived}
+        FROM json_each(?) AS j JOIN People ON personID = j.value
+        ORDER BY j.key""",
+    select_ids="""SELECT personID, first, last FROM People""",
+    insert_record="""INSERT INTO People ({columns})
+        VALUES ({placeholders})""",
+    update_record="""UPDATE People SET {assignments}
+        WHERE personID = ?""",
+    )
+
+
+# Named sets of PRAGMAs applied to each connection as it is
+# opened (see Session.connect.)  All use write ahead logging so
+# that readers don't wait for a writer; they differ in how much
+# durability is traded for speed and in how much memory (page
+# cache, memory mapped I/O) is used.
+pragma_profiles = {
+    'bulk-load': dict(  # only for filling an empty table:
+        journal_mode='WAL',     # a crash may corrupt the file
+        synchronous='OFF',
+        cache_size=-262144,     # KiB (256 MiB)
+        mmap_size=268435456,    # bytes (256 MiB)
+        temp_store='MEMORY',
+        ),
+    'bulk-update': dict(  # for changing existing data in bulk
+        journal_mode='WAL',
+        synchronous='NORMAL',
+        cache_size=-262144,
+        mmap_size=268435456,
+        temp_store='MEMORY',
+        ),
+    'interactive': dict(
+        journal_mode='WAL',
+        synchronous='NORMAL',   # durable except on power loss
+        cache_size=-16384,      # 16 MiB
+        mmap_size=67108864,     # 64 MiB
+        temp_store='MEMORY',
+        ),
+    'read-mostly': dict(  # lookups and mailings
+        journal_mode='WAL',
+        synchronous='NORMAL',
+        cache_size=-65536,      # 64 MiB
+        mmap_size=1073741824,   # 1 GiB
+        temp_store='MEMORY',
+        ),
+    }
+pragma_profile = 'interactive'  # used when a connection is opened
+
+# Set (by --in-memory) to work on a copy of the data base held
+# in memory: see Session.
+in_memory = False
+flush_interval = 60  # seconds between writes back to disk
+
+
+def apply_pragmas(connection, profile):
+    """
+    Applies the PRAGMAs of <profile> (a key of pragma_profiles
+    or a dict like its values) to <connection>.
+    Returns a dict of the values they had before.
+    """
+    if isinstance(profile, str):
+        profile = pragma_profiles[profile]
+    previous = dict()
+    for name, value in profile.items():
+        current = connection.execute(f"PRAGMA {name}").fetchone()
+        if current is None:  # eg mmap_size of a memory data base
+            continue
+        previous[name] = current[0]
+        connection.execute(f"PRAGMA {name} = {value}").fetchall()
+    return previous
+
+
+def get_bulk_profile(connection, table='People'):
+    """
+    Returns the pragma profile for a bulk change to <table>:
+    'bulk-load' (no syncing at all) only if it's empty, ie if
+    there's nothing to lose; otherwise 'bulk-update'.
+    """
+    empty = connection.execute(
+            f"SELECT 1 FROM {table} LIMIT 1").fetchone() is None
+    return 'bulk-load' if empty else 'bulk-update'
+
+
+@contextlib.contextmanager
+def pragmas(connection, profile):
+    """
+    Context manager: <connection> uses the PRAGMAs of <profile>
+    until the end of the with block, after which the previous
+    settings are restored. Journal mode can't be changed within
+    a transaction so use outside of one.
+    """
+    previous = apply_pragmas(connection, profile)
+    try:
+        yield connection
+    finally:
+        apply_pragmas(connection, previous)
+
+
+class QueryStats(object):
+    """
+    Collects, for each shape of SQL statement (the statement
+    with literals replaced by '?'s and white space collapsed,)
+    the number of times it was executed, the time taken by
+    each execution, the time spent fetching its rows and the
+    number of rows fetched. See instrument_queries.
+    """
+
+    literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+    def __init__(self):
+        self.shapes = dict()  # shape: [n, [latencies], fetch time, rows]
+
+    def get_shape(self, sql):
+        shape = self.literals.sub('?', ' '.join(sql.split()))
+        return re.sub(r"\(\?(?:, \?)+\)", "(?, ..)", shape)
+
+    def add_execution(self, sql, elapsed, rows=0):
+        entry = self.shapes.setdefault(self.get_shape(sql),
+                                       [0, [], 0.0, 0])
+        entry[0] += 1
+        entry[1].append(elapsed)
+        entry[3] += rows
+
+    def add_fetch(self, sql, elapsed, rows):
+        entry = self.shapes.setdefault(self.get_shape(sql),
+                                       [0, [], 0.0, 0])
+        entry[2] += elapsed
+        entry[3] += rows
+
+    def report(self, top=20, width=70):
+        """
+        Returns a report (a string) of the <top> statement
+        shapes in order of total time (execution + fetching.)
+        Times are in milliseconds; p50 and p95 are of the time
+        taken by each execution.
+        """
+        def percentile(ordered, fraction):
+            return ordered[min(len(ordered) - 1,
+                               int(fraction * len(ordered)))]
+
+        lines = ["{:>7} {:>9} {:>8} {:>8} {:>8} {:>8}  {}".format(
+                 'count', 'total', 'p50', 'p95', 'max', 'rows',
+                 'statement')]
+        entries = sorted(self.shapes.items(),
+                         key=lambda item: -(sum(item[1][1]) + item[1][2]))
+        for shape, (n, latencies, fetch_time, rows) in entries[:top]:
+            ordered = sorted(latencies) or [0.0]
+            lines.append(
+                "{:7} {:9.2f} {:8.3f} {:8.3f} {:8.3f} {:8}  {}".format(
+                    n, 1000 * (sum(latencies) + fetch_time),
+                    1000 * percentile(ordered, 0.50),
+                    1000 * percentile(ordered, 0.95),
+                    1000 * ordered[-1], rows, shape[:width]))
+        return '\n'.join(lines)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    A cursor which reports (to query_stats) the time taken
+    by each statement and by fetching its rows.
+    """
+
+    _sql = ''
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._sql = sql
+            query_stats.add_execution(sql,
+                    time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._sql = sql
+            query_stats.add_execution(sql,
+                    time.perf_counter() - start,
+                    max(self.rowcount, 0))
+
+    def _fetched(self, start, rows):
+        query_stats.add_fetch(self._sql,
+                time.perf_counter() - start, rows)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        start = time.perf_counter()
+        rows = super().fetchmany(*args, **kwargs)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(start, 0)
+            raise
+        self._fetched(start, 1)
+        return row
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    A connection all of whose cursors are TimedCursors.
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+query_stats = None  # a QueryStats once instrument_queries is called
+
+
+def instrument_queries():
+    """
+    Turns on the timing of queries (see QueryStats): the
+    session is closed so that its connections are reopened
+    as TimedConnections. A report is printed at exit.
+    """
+    global query_stats
+    if query_stats is None:
+        query_stats = QueryStats()
+        close_session()
+        atexit.register(print_query_stats)
+
+
+def print_query_stats():
+    """
+    Prints the query timings (if being collected) to stderr
+    so they're kept out of a command's output.
+    """
+    if query_stats is not None:
+        print(query_stats.report(), file=sys.stderr)
+
+
+class Session(object):
+    """
+    Holds one long lived connection to <db_file> which is
+    shared by all the functions that query the data base
+    so the cost of connecting is paid once per session
+    rather than once per query.
+    If <pool_size> is set, up to that many further
+    connections are kept for threaded callers (a sqlite3
+    connection should only be used by one thread at a
+    time) and handed out by the <pooled> context manager.
+    Can be used as a context manager; otherwise call
+    close() when done.
+    Each connection is set up as per <profile> (a key of
+    pragma_profiles; default: pragma_profile.)
+    If <in_memory> is set, <db_file> is copied (using the
+    backup API) into a memory data base when the session is
+    first used and all connections are to that copy. Changes
+    are copied back by flush: when the session is closed and
+    whenever maybe_flush is called at least <flush_interval>
+    seconds after the last flush. The copy replaces all of
+    db_file so, if another process has changed db_file since
+    it was loaded, flush refuses (rather than lose those
+    changes) and close saves the memory data base to
+    '<db_file>.unsaved' instead.
+    """
+
+    def __init__(self, db_file=None, pool_size=0, profile=None,
+                 in_memory=False, flush_interval=None):
+        if db_file is None:
+            db_file = db_file_name
+        if flush_interval is None:
+            flush_interval = globals()['flush_interval']
+        self.db_file = db_file
+        self.pool_size = pool_size
+        self.profile = profile  # default: pragma_profile
+        self.in_memory = in_memory
+        self.flush_interval = flush_interval
+        # (a shared cache so pooled connections see the same copy)
+        self._memory_uri = ("file:letter-{}-{}?mode=memory&cache=shared"
+                            .format(os.getpid(), id(self)))
+        self._flushed_changes = 0  # connection.total_changes
+        self._flushed_at = None
+        self._disk = None  # connection to db_file (if in_memory)
+        self._disk_version = None  # its data_version when loaded
+        self._connection = None
+        self._pool = queue.LifoQueue()
+        self._n_pooled = 0  # connections created for the pool
+        self._lock = threading.Lock()
+        self._schema = dict()  # keyed by table name
+        self._schema_version = None
+        self._schema_checked = False
+        self._statements = dict()  # keyed by statement name
+        # read caches (see check_caches)
+        self._records = collections.OrderedDict()  # LRU
+        self._ids_w_names = None
+        self._data_key = None
+
+    def connect(self, check_same_thread=True):
+        """
+        Returns a new connection to the session's data base.
+        """
+        if self.in_memory:
+            database, uri = self._memory_uri, True
+        else:
+            database, uri = self.db_file, False
+        con = sqlite3.connect(database, uri=uri,
+                check_same_thread=check_same_thread,
+                factory=(sqlite3.Connection if query_stats is None
+                         else TimedConnection))
+        apply_pragmas(con, self.profile or pragma_profile)
+        return con
+
+    @property
+    def connection(self):
+        """
+        The session's (lazily opened) main connection.
+        """
+        if self._connection is None:
+            self._connection = self.connect()
+            if self.in_memory:  # load the copy
+                # (kept open: its data_version then changes
+                # only if another connection commits a change)
+                self._disk = sqlite3.connect(self.db_file)
+                self._disk_version = self.disk_version()
+                self._disk.backup(self._connection)
+                self._flushed_changes = self._connection.total_changes
+                self._flushed_at = time.monotonic()
+        return self._connection
+
+    def disk_version(self):
+        return self._disk.execute(
+                "PRAGMA data_version").fetchone()[0]
+
+    def disk_changed(self):
+        """
+        Returns True if (in_memory and) another connection has
+        changed db_file since it was loaded.
+        """
+        return (self._disk is not None
+                and self.disk_version() != self._disk_version)
+
+    def unflushed(self):
+        """
+        Returns True if (in_memory and) the main connection has
+        made changes since the last flush.
+        """
+        return (self.in_memory and self._connection is not None
+                and self._connection.total_changes
+                    != self._flushed_changes)
+
+    def flush(self, pages=1024, force=False):
+        """
+        Copies the memory data base (if in_memory) back to
+        db_file, <pages> at a time so that the copy doesn't
+        hold a lock for long. Only done if the main connection
+        has made changes since the last flush and isn't in the
+        middle of a transaction and (unless <force>) if no other
+        connection has changed db_file since it was loaded.
+        Returns True if it was done.
+        (Changes made through pooled connections are copied
+        but don't, on their own, cause a flush.)
+        """
+        con = self._connection
+        if not self.unflushed() or con.in_transaction:
+            return False
+        if self.disk_changed() and not force:
+            print(f"{self.db_file} has been changed by another"
+                  " process: the in memory copy was not written"
+                  " to it.")
+            return False
+        con.backup(self._disk, pages=pages)
+        self._flushed_changes = con.total_changes
+        self._flushed_at = time.monotonic()
+        return True
+
+    def maybe_flush(self):
+        """
+        Flushes if <flush_interval> seconds have passed since
+        the last flush. Meant to be called between commands
+        (so a flush never interrupts one.)
+        """
+        if (self._flushed_at is not None
+                and time.monotonic() - self._flushed_at
+                    >= self.flush_interval):
+            if not self.flush():
+                self._flushed_at = time.monotonic()
+
+    def cursor(self):
+        return self.connection.cursor()
+
+    def ensure_schema(self):
+        """
+        Runs the (idempotent) creation_script once per session
+        so that a data base made by an earlier version of the
+        script gets any tables or indices added since. (A new
+        full text index is populated from existing records.)
+        """
+        if not self._schema_checked:
+            con = self.connection
+            had_fts = con.execute("""SELECT 1 FROM sqlite_master
+                WHERE name = 'People_fts'""").fetchone()
+            with con:
+                for query in get_sql(creation_script):
+                    try:
+                        con.execute(query)
+                    except sqlite3.OperationalError as error:
+                        # ALTER TABLE of an up to date table
+                        if 'duplicate column' not in str(error):
+                            raise
+                if not had_fts:  # index the existing records
+                    con.execute("INSERT INTO People_fts (People_fts)"
+                                " VALUES ('rebuild')")
+            self._schema_checked = True
+
+    def table_info(self, table='People'):
+        """
+        Returns a dict (in column order) keyed by the column
+        names of <table> with values being their defaults.
+        Read (see get_column_defaults) the first time and then
+        served from a cache which is only discarded when the
+        data base's schema_version changes.
+        """
+        version = self.connection.execute(
+                "PRAGMA schema_version").fetchone()[0]
+        if version != self._schema_version:
+            self._schema = dict()
+            self._statements = dict()
+            self._schema_version = version
+            self._records.clear()  # made with the old columns
+        if table not in self._schema:
+            self._schema[table] = get_column_defaults(
+                                    self.connection, table)
+        return self._schema[table]
+
+    def derived_columns(self, table='People'):
+        """
+        Returns a list of the names of the generated columns
+        of <table> (which table_info leaves out.) Cached as
+        table_info is.
+        """
+        self.table_info(table)  # discards stale cache
+        key = ('derived', table)
+        if key not in self._schema:
+            self._schema[key] = [item[1] for item in
+                self.connection.execute(
+                    f"PRAGMA table_xinfo({table})")
+                if item[6] in (2, 3)]  # virtual, stored
+        return self._schema[key]
+
+    def statement(self, name):
+        """
+        Returns the SQL of statement_templates[<name>]
+        formatted for the current schema of People.
+        """
+        columns = list(self.table_info('People'))[1:]
+        if name not in self._statements:
+            self._statements[name] = statement_templates[name].format(
+                columns=', '.join(columns),
+                derived=''.join([', ' + column for column
+                                 in self.derived_columns('People')]),
+                placeholders=', '.join(['?'] * len(columns)),
+                assignments=', '.join([f"{column} = ?"
+                                       for column in columns]))
+        return self._statements[name]
+
+    def check_caches(self):
+        """
+        Empties the read caches (of records and IDs) if the
+        data may have changed since they were filled: ie if
+        this connection has made changes (total_changes) or
+        another has committed some (PRAGMA data_version.)
+        """
+        con = self.connection
+        key = (con.execute("PRAGMA data_version").fetchone()[0],
+               con.total_changes)
+        if key != self._data_key:
+            self._records.clear()
+            self._ids_w_names = None
+            self._data_key = key
+
+    def record(self, peopleID):
+        """
+        Returns a copy of the record (a Contact, see get_record)
+        of <peopleID> (None if there isn't one) from a cache of
+        the <record_cache_size> most recently used records,
+        querying only if it's not there.
+        """
+        self.check_caches()
+        try:
+            key = int(peopleID)
+        except (TypeError, ValueError):
+            key = peopleID
+        if key in self._records:
+            self._records.move_to_end(key)
+            rec = self._records[key]
+        else:
+            cur = self.connection.cursor()
+            cur.row_factory = Contact
+            execute(cur, self.connection,
+                    self.statement('select_record'), (key, ))
+            rec = cur.fetchone()
+            self._records[key] = rec
+            if len(self._records) > record_cache_size:
+                self._records.popitem(last=False)
+        if rec is not None:
+            rec = rec.copy()  # so callers can't change the cache
+        return rec
+
+    def ids_w_names(self):
+        """
+        Returns a (cached) list of (personID, first, last)
+        tuples, one for each record.
+        """
+        self.check_caches()
+        if self._ids_w_names is None:
+            cur = self.connection.cursor()
+            execute(cur, self.connection, self.statement('select_ids'))
+            self._ids_w_names = cur.fetchall()
+        return list(self._ids_w_names)
+
+    @contextlib.contextmanager
+    def pooled(self):
+        """
+        Context manager providing a connection for use by
+        a thread. A new connection is made only if none is
+        free and fewer than <pool_size> exist; otherwise
+        waits for another thread to return one.
+        Without a pool the main connection is provided.
+        """
+        if not self.pool_size:
+            yield self.connection
+            return
+        try:
+            con = self._pool.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                make_new = self._n_pooled < self.pool_size
+                if make_new:
+                    self._n_pooled += 1
+            if make_new:
+                con = self.connect(check_same_thread=False)
+            else:
+                con = self._pool.get()
+        try:
+            yield con
+        finally:
+            self._pool.put(con)
+
+    def close(self):
+        """
+        Closes the main connection and any pooled ones
+        (first flushing if in_memory.)
+        The session can still be used: connections are
+        reopened as needed.
+        """
+        if not self.flush() and self.unflushed() and self.disk_changed():
+            unsaved = sqlite3.connect(self.db_file + '.unsaved')
+            try:
+                self._connection.backup(unsaved)
+            finally:
+                unsaved.close()
+            print(f"Changes made in memory saved to {self.db_file}"
+                  ".unsaved")
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+        self._schema = dict()
+        self._schema_version = None
+        self._records.clear()
+        self._ids_w_names = None
+        self._data_key = None
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+        self._n_pooled = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Contact(object):
+    """
+    A People record as made (by sqlite3, being used as the
+    cursor's row_factory) straight from a query's row.
+    Fields are accessed by name (ie record['first']) and,
+    as with the dicts it replaces, items can be added (as
+    letters.add_name4presentation does.)
+    'full_name' and 'full_address' (also available as
+    attributes) come from the query if it provided them
+    (see the derived columns in creation_script) and are
+    otherwise worked out when first asked for.
+    Pickles as a dict (for rendering in other processes.)
+    """
+    __slots__ = ('_row', '_added')
+
+    def __init__(self, cursor, row):
+        self._row = sqlite3.Row(cursor, row)
+        self._added = None  # a dict once something is added
+
+    def __getitem__(self, key):
+        if self._added and key in self._added:
+            return self._added[key]
+        try:
+            return self._row[key]
+        except IndexError:
+            if key == 'full_name':
+                value = letters.full_name(self)
+            elif key == 'full_address':
+                value = letters.address_template.format_map(self)
+            else:
+                raise KeyError(key)
+            self[key] = value
+            return value
+
+    def __setitem__(self, key, value):
+        if self._added is None:
+            self._added = dict()
+        self._added[key] = value
+
+    def keys(self):
+        keys = self._row.keys()
+        if self._added:
+            keys.extend([key for key in self._added
+                         if key not in keys])
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    @property
+    def full_name(self):
+        return self['full_name']
+
+    @property
+    def full_address(self):
+        return self['full_address']
+
+    def copy(self):
+        """
+        Returns a Contact with the same fields whose added
+        items are its own.
+        """
+        new = Contact.__new__(Contact)
+        new._row = self._row
+        new._added = dict(self._added) if self._added else None
+        return new
+
+    def __reduce__(self):
+        return (dict, (dict(self.items()), ))
+
+    def __repr__(self):
+        return "Contact({})".format(dict(self.items()))
+
+
+_session = None
+
+
+def get_session():
+    """
+    Returns the module's shared Session (creating it
+    the first time it's needed.)
+    """
+    global _session
+    if _session is None:
+        _session = Session(db_file_name, in_memory=in_memory)
+    return _session
+
+
+def close_session():
+    global _session
+    if _session is not None:
+        _session.close()
+        _session = None
+
+
+atexit.register(close_session)
+
 
 def get_sql(sql_file):
     """
     Reads what are assumed to be valid SQL queries
     from <sql_file> 'yield'ing them one at a time.
+    A query ends with a line ending in ';' except that
+    a CREATE TRIGGER ends only with its 'END;' line.
     Usage:
         con = sqlite3.connect("sql.db")
         cur = con.cursor()
@@ -49,18 +812,31 @@ def get_sql(sql_file):
             line = line.strip()
             if line.startswith('--'):
                 continue
-            query = query + line.strip()
+            query = (query + ' ' + line).strip()
             if line.endswith(';'):
+                if (query.upper().startswith('CREATE TRIGGER')
+                        and line.upper() != 'END;'):
+                    continue
                 yield query[:-1]
                 query = ''
 
 
+def open_input(file_name, newline=None):
+    """
+    Opens <file_name> for reading; '-' means standard input
+    (which is left open when the with block ends.)
+    """
+    if file_name == '-':
+        return contextlib.nullcontext(sys.stdin)
+    return open(file_name, 'r', newline=newline)
+
+
 def csv_data_generator(filename):
     """
-    Yield records from a csv data base.
+    Yield records from a csv data base ('-': standard input.)
     Used to populate the data base from a csv file.
     """
-    with open(filename, 'r', newline='') as instream:
+    with open_input(filename, newline='') as instream:
 #       reader = csv.DictReader(instream)
         reader = csv.DictReader(instream, restkey='extra')
         for rec in reader:
@@ -77,69 +853,369 @@ def get_csv_field_names(csv_file):
         return(reader.fieldnames)
 
 
-def get_insert_query(record, table):
+def get_insert_values(record):
     """
-    Returns valid sql syntax to populate <table>
-    with all of <record>'s non empty fields.
+    Returns the parameters for the 'insert_record' statement:
+    a value for every column (but personID) of People, being
+    <record>'s value for it or, if that's empty or missing,
+    the column's default.
     """
-    keys_w_values = []
-    values = []
-    for key in [key for key in record.keys()]:
-        if key == 'extra':
-            continue
-        value = record[key]
-        if value:
-            keys_w_values.append(key)
-            if not isinstance(value, str):
-                _ = input(f"{key}: {value}")
-            value = '"{}"'.format(value)
-            values.append(value)
-    keys = ', '.join(keys_w_values)
-    values = ', '.join(values)
-    query = insert_template.format(
-            table=table, keys=keys, values=values)
-#       _ = input(query)
-    return query
-
-
-def execute(cursor, connection, query):
+    defaults = get_session().table_info('People')
+    return [record.get(key) or default
+            for key, default in list(defaults.items())[1:]]
+
+
+def execute(cursor, connection, query, params=()):
     """
     Wrapper to provide debugging
     information should a query fail.
     """
     try:
-        cursor.execute(query)
+        cursor.execute(query, params)
     except (sqlite3.IntegrityError, sqlite3.OperationalError):
         print("Unable to execute following query:")
         print(query)
+        if params:
+            print(f"with parameters: {params}")
         raise
     connection.commit()
 
 
-def initiate_db_cmd():
+def get_column_defaults(connection, table):
+    """
+    Returns a dict keyed by the column names of <table>
+    with values being the column's default value.
+    """
+    info = connection.execute(
+            f"PRAGMA table_info({table})").fetchall()
+    # <dflt_value> (item[4]) is the SQL text of the default
+    # (ex: "'USA'") so let sqlite evaluate it for us.
+    defaults = ', '.join([item[4] if item[4] else 'NULL'
+                          for item in info])
+    values = connection.execute(f"SELECT {defaults}").fetchone()
+    return {item[1]: value for item, value in zip(info, values)}
+
+
+def bulk_insert(connection, keys, rows, table='People',
+                batch_size=None, report=True):
+    """
+    Populates <table> with <rows> (an iterable of sequences
+    of values for the columns named in <keys>.)
+    Rows are inserted <batch_size> (default: import_batch_size)
+    at a time using executemany and a single parameterized
+    query, all within one transaction (so only one commit
+    is paid for regardless of how many rows there are) and
+    with the pragma profile given by get_bulk_profile.
+    Loading into an empty People, the full text index isn't
+    updated (by its trigger) for each row but is built once
+    at the end, which takes about half the time.
+    As with get_insert_values: empty fields are given the
+    column's default value.
+    Returns the number of rows inserted.
+    """
+    if not batch_size:
+        batch_size = import_batch_size
+    defaults = get_column_defaults(connection, table)
+    defaults = [defaults.get(key, '') for key in keys]
+    query = insert_template.format(table=table,
+            keys=', '.join(keys),
+            values=', '.join(['?'] * len(keys)))
+    profile = get_bulk_profile(connection, table)
+    fts_trigger = None  # its SQL if it's to be left out
+    if table == 'People' and profile == 'bulk-load':  # ie empty
+        row = connection.execute("""SELECT sql FROM sqlite_master
+            WHERE type = 'trigger' AND name = 'People_fts_insert'
+            """).fetchone()
+        if row:
+            fts_trigger = row[0]
+    n_records = 0
+    start = time.perf_counter()
+    with pragmas(connection, profile), connection:
+        # commits (or rolls back) once, at the end
+        if not connection.in_transaction:
+            # (else DROP TRIGGER would be committed on its own)
+            connection.execute("BEGIN")
+        if fts_trigger:
+            connection.execute("DROP TRIGGER People_fts_insert")
+        cursor = connection.cursor()
+        for batch in helpfuncs.batches(rows, batch_size):
+            batch = [[value if value else default
+                      for value, default in zip(row, defaults)]
+                     for row in batch]
+            try:
+                cursor.executemany(query, batch)
+            except (sqlite3.IntegrityError,
+                    sqlite3.OperationalError):
+                print("Unable to execute following query:")
+                print(query)
+                raise
+            n_records += len(batch)
+        if fts_trigger:
+            connection.execute("INSERT INTO People_fts (People_fts)"
+                               " VALUES ('rebuild')")
+            connection.execute(fts_trigger)
+    elapsed = time.perf_counter() - start
+    if report:
+        print("Imported {} records in {:.2f} seconds ({:.0f} rows/sec)"
+              .format(n_records, elapsed,
+                      n_records / elapsed if elapsed else 0))
+    return n_records
+
+
+def bulk_import(connection, csv_file, table='People',
+                batch_size=None, report=True):
+    """
+    Populates <table> with the records in <csv_file>
+    (streamed from csv_data_generator) using bulk_insert.
+    As before, the 'extra' field is ignored.
+    Returns the number of records inserted.
+    """
+    records = csv_data_generator(csv_file)
+    first = next(records, None)
+    keys = [] if first is None else [key for key in first.keys()
+                                     if key != 'extra']
+    rows = ([record[key] for key in keys]
+            for record in itertools.chain((first, ), records)
+            if record is not None)
+    return bulk_insert(connection, keys, rows, table=table,
+                       batch_size=batch_size, report=report)
+
+
+def ingest_google(connection, google_csv=None, csv_copy=None,
+                  batch_size=None, workers=1, report=True):
+    """
+    Populates People directly from a google contacts export
+    (default: convert_g.google_csv) without first writing (and
+    then re-reading) "my csv" format files: the converted rows
+    (see convert_g.converted_rows) are fed straight to
+    bulk_insert. As with convert_g.main, contacts without an
+    address are left out.
+    If <csv_copy> is provided, the converted rows are also
+    written to it (as convert_g.main would have.)
+    Returns the number of records inserted.
+    """
+    if google_csv is None:
+        google_csv = convert_g.google_csv
+    keys = [key for key in convert_g.my_fields if key != 'extra']
+    positions = [convert_g.my_fields.index(key) for key in keys]
+    address = convert_g.my_fields.index('address')
+    outstream = None
+    if csv_copy:
+        outstream = open(csv_copy, 'w', newline='')
+        writer = csv.writer(outstream, lineterminator='\n')
+        writer.writerow(convert_g.my_fields)
+
+    def rows():
+        for values in convert_g.converted_rows(google_csv,
+                                               workers=workers):
+            if not values[address]:
+                continue
+            if outstream:
+                writer.writerow(values)
+            yield [values[i] for i in positions]
+
+    try:
+        return bulk_insert(connection, keys, rows(),
+                           batch_size=batch_size, report=report)
+    finally:
+        if outstream:
+            outstream.close()
+
+
+def ingest_google_cmd():
+    google_csv = input("Google contacts file (default: {}): "
+                       .format(convert_g.google_csv))
+    if not google_csv:
+        google_csv = convert_g.google_csv
+    csv_copy = input(
+        "Also save converted contacts to (default: don't): ")
+    get_session().ensure_schema()
+    ingest_google(get_session().connection, google_csv,
+                  csv_copy=csv_copy or None)
+
+
+def get_natural_key(record):
+    """
+    Returns the key by which sync matches a record to a
+    contact: its last, first and email fields (normalized
+    for case and white space.)
+    """
+    return '|'.join([' '.join(str(record.get(key) or '').split()).lower()
+                     for key in ('last', 'first', 'email')])
+
+
+def get_content_hash(values):
+    return hashlib.sha1('\x1f'.join(
+        [str(value) for value in values]).encode()).hexdigest()
+
+
+def sync(connection, csv_file, batch_size=None, report=True,
+         confirm=None):
+    """
+    Brings People up to date with <csv_file> without
+    rebuilding it: records are matched by natural key (see
+    get_natural_key) and only those that are new, changed
+    (according to the content hash kept in SyncState) or no
+    longer in <csv_file> are inserted, updated or deleted.
+    All in one transaction.
+    Records not yet in SyncState (ie from initiate_db_cmd or
+    add_new_contact) are entered first. If two records share
+    a natural key, only the first is tracked (so the other is
+    left alone) and in <csv_file> the last one wins.
+    Note that this includes records added by add_new_contact:
+    unless they are also in <csv_file> they are deleted. So,
+    if <confirm> is provided, it's called (before anything is
+    committed) with the numbers of records to be inserted,
+    updated and deleted and, if it returns False, all is
+    rolled back.
+    Returns a tuple: (n inserted, n updated, n deleted.)
+    """
+    if not batch_size:
+        batch_size = import_batch_size
+    records = csv_data_generator(csv_file)
+    first = next(records, None)
+    if first is None:
+        print(f"{csv_file} has no records: nothing done.")
+        return (0, 0, 0)
+    keys = [key for key in first.keys() if key != 'extra']
+    defaults = get_column_defaults(connection, 'People')
+    defaults = [defaults.get(key, '') for key in keys]
+    insert_query = insert_template.format(table='People',
+            keys=', '.join(keys),
+            values=', '.join(['?'] * len(keys)))
+    update_query = "UPDATE People SET {} WHERE personID = ?".format(
+            ', '.join([f"{key} = ?" for key in keys]))
+    start = time.perf_counter()
+    n_inserted = n_updated = n_deleted = 0
+    with pragmas(connection, get_bulk_profile(connection)), connection:
+        # one transaction
+        cur = connection.cursor()
+        cur.execute("""DELETE FROM SyncState WHERE personID
+                NOT IN (SELECT personID FROM People)""")
+        cur.execute("""SELECT p.personID, {} FROM People AS p
+                LEFT JOIN SyncState AS s USING (personID)
+                WHERE s.personID IS NULL""".format(
+                    ', '.join([f"p.{key}" for key in keys])))
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            connection.executemany("""INSERT OR IGNORE INTO SyncState
+                    (personID, natural_key, content_hash)
+                    VALUES (?, ?, ?)""",
+                [(row[0], get_natural_key(dict(zip(keys, row[1:]))),
+                  get_content_hash(row[1:])) for row in rows])
+        state = {natural_key: (personID, content_hash)
+                 for personID, natural_key, content_hash
+                 in cur.execute("""SELECT personID, natural_key,
+                        content_hash FROM SyncState""")}
+        seen = set()
+        updates = []
+        hash_updates = []
+
+        def update_batch():
+            cur.executemany(update_query, updates)
+            cur.executemany("""UPDATE SyncState SET content_hash = ?
+                    WHERE personID = ?""", hash_updates)
+            updates.clear()
+            hash_updates.clear()
+
+        for record in itertools.chain((first, ), records):
+            values = [record[key] if record[key] else default
+                      for key, default in zip(keys, defaults)]
+            natural_key = get_natural_key(record)
+            content_hash = get_content_hash(values)
+            seen.add(natural_key)
+            old = state.get(natural_key)
+            if old is None:
+                cur.execute(insert_query, values)
+                personID = cur.lastrowid
+                cur.execute("""INSERT INTO SyncState
+                        (personID, natural_key, content_hash)
+                        VALUES (?, ?, ?)""",
+                        (personID, natural_key, content_hash))
+                state[natural_key] = (personID, content_hash)
+                n_inserted += 1
+            elif old[1] != content_hash:
+                updates.append(values + [old[0]])
+                hash_updates.append((content_hash, old[0]))
+                state[natural_key] = (old[0], content_hash)
+                if len(updates) >= batch_size:
+                    update_batch()
+                n_updated += 1
+        update_batch()
+        gone = [(personID, ) for natural_key, (personID, _)
+                in state.items() if natural_key not in seen]
+        cur.executemany("DELETE FROM People WHERE personID = ?", gone)
+        cur.executemany("DELETE FROM SyncState WHERE personID = ?",
+                        gone)
+        n_deleted = len(gone)
+        if confirm is not None and not confirm(
+                n_inserted, n_updated, n_deleted):
+            connection.rollback()
+            n_inserted = n_updated = n_deleted = 0
+            if report:
+                print("Sync cancelled: nothing changed.")
+                report = False
+    elapsed = time.perf_counter() - start
+    if report:
+        print("Sync: {} inserted, {} updated, {} deleted in {:.2f} seconds"
+              .format(n_inserted, n_updated, n_deleted, elapsed))
+    return (n_inserted, n_updated, n_deleted)
+
+
+def sync_cmd():
+    csv_file = input("Refresh from (default: {}): ".format(source_csv))
+    if not csv_file:
+        csv_file = source_csv
+    get_session().ensure_schema()
+
+    def confirm(n_inserted, n_updated, n_deleted):
+        if not n_deleted:
+            return True
+        print("{} records to be inserted, {} updated and {} deleted."
+              .format(n_inserted, n_updated, n_deleted))
+        response = input("Records not in {} (including any added"
+                         " with A)dd) will be deleted. Continue? (y/n) "
+                         .format(csv_file))
+        return bool(response and response[0] in 'yY')
+
+    sync(get_session().connection, csv_file, confirm=confirm)
+
+
+def initiate_db():
     """
     Re-initializes the data base as per content of files
-    declared as globals: db_file_name, creation_script;
-    with option to populate with data from source_csv
+    declared as globals: db_file_name, creation_script.
+    Returns the (new) session connection.
     """
-    print("Initiating the data base.")
-    if os.path.exists(db_file_name):
-        os.remove(db_file_name)
-    con = sqlite3.connect(db_file_name)
+    close_session()  # don't leave a connection to a deleted file
+    for file_name in (db_file_name, db_file_name + '-wal',
+                      db_file_name + '-shm'):
+        if os.path.exists(file_name):
+            os.remove(file_name)
+    con = get_session().connection
     cur = con.cursor()
     ## set up the tables (first deleting any that exist)
     for query in get_sql(creation_script):
 #       print(query)
         execute(cur, con, query)
 #   _ = input(f"Table Names: {get_table_names(cur)}")
+    return con
+
+
+def initiate_db_cmd():
+    """
+    Runs initiate_db with option to populate with data
+    from source_csv
+    """
+    print("Initiating the data base.")
+    con = initiate_db()
     yes_no = input(
             "Populate table with data from {}? "
             .format(source_csv))
     if yes_no and yes_no[0] in 'yY':
-        for record in csv_data_generator(source_csv):
-            query = get_insert_query(record, 'People')
-    #       _ = input(query)
-            execute(cur, con, query)
+        bulk_import(con, source_csv)
 
 
 def get_fieldnames(includeID=False):
@@ -148,10 +1224,10 @@ def get_fieldnames(includeID=False):
     (in the only/People table.)
     Option allows inclusion of the primary key
     (which is left out by default.)
+    The names come from the session's schema cache
+    so no query of the table itself is needed.
     """
-    con = sqlite3.connect(db_file_name)
-    cur = con.execute("SELECT * FROM People")
-    res = ([item[0] for item in cur.description])
+    res = list(get_session().table_info('People'))
     if not includeID:
         res = res[1:]
     return res
@@ -165,12 +1241,6 @@ def update():
         'Continue with modification of above record? (y/n)')
     if not response or not response in 'yY':
         return
-    update_query_template = """UPDATE {table}
-        SET {clauses}
-        WHERE personID = {personID}
-    """
-    fieldnames = get_fieldnames()
-#   _ = input(fieldnames)
     rec = get_record(idkey)
 #   _ = input(rec)
     updates = []
@@ -178,7 +1248,8 @@ def update():
     print("\t* don't change")
     print("\t$ leave remaining")
     print("\t^ leave blank")
-    for key in rec.keys():
+    fieldnames = get_fieldnames()
+    for key in fieldnames:
         entry = input(f'{key}: {rec[key]}  change to ..  ')
         if entry:
             if entry == '*':  # don't change field
@@ -190,29 +1261,27 @@ def update():
                 continue
             updates.append((key, entry,))
 #   _ = input(f"updates: {updates}")
-    clauses = []
-    for key, entry in updates:
-        clauses.append(f"{key} = '{entry}'")
-    if not clauses:
+    if not updates:
         print("No update performed.")
         return
-    clauses = ', '.join(clauses)
-    con = sqlite3.connect(db_file_name)
+    rec = dict(rec.items())
+    rec.update(updates)
+    session = get_session()
+    con = session.connection
     cur = con.cursor()
-    execute(cur, con,
-        update_query_template.format(table='People',
-                                    clauses=clauses,
-                                    personID=idkey))
+    execute(cur, con, session.statement('update_record'),
+            [rec[key] for key in fieldnames] + [idkey])
 
 
 def add_new_contact():
-    con = sqlite3.connect(db_file_name)
+    session = get_session()
+    con = session.connection
     cur = con.cursor()
     record = dict()
     for key in get_fieldnames(): 
         record[key] = input(f"{key}: ")
-    query = get_insert_query(record, 'People')
-    execute(cur, con, query)
+    execute(cur, con, session.statement('insert_record'),
+            get_insert_values(record))
 
 
 def add_cmd():
@@ -229,45 +1298,145 @@ def add_cmd():
 
 
 def get_IDs_w_names():
-    con = sqlite3.connect(db_file_name)
-    cur = con.cursor()
-    query = """Select personID, first, last 
-                    FROM People;"""
-    execute(cur, con, query)
-    return cur.fetchall()
+    return get_session().ids_w_names()
+
+
+def get_index_page(key=None, backwards=False, size=None):
+    """
+    Returns a list of up to <size> (default: index_page_size)
+    (personID, first, last, sort_name) tuples in order of
+    sort_name then personID, beginning just after <key> (or,
+    if <backwards>, ending just before it.) <key> is a
+    (sort_name, personID) tuple; if None, the page is the
+    first (or last) one.
+    Keyset pagination (rather than OFFSET) on the
+    People_sort_name index means the cost of fetching a page
+    doesn't depend on where it is or on the size of the table.
+    """
+    if size is None:
+        size = index_page_size
+    session = get_session()
+    session.ensure_schema()
+    order = 'DESC' if backwards else 'ASC'
+    if key is None:
+        where = ''
+        params = (size, )
+    else:
+        where = "WHERE (sort_name, personID) {} (?, ?)".format(
+                '<' if backwards else '>')
+        params = tuple(key) + (size, )
+    query = """SELECT personID, first, last, sort_name FROM People
+        {where} ORDER BY sort_name {order}, personID {order}
+        LIMIT ?""".format(where=where, order=order)
+    res = session.connection.execute(query, params).fetchall()
+    if backwards:
+        res.reverse()
+    return res
 
 
 def show_index():
-    print('Collecting keys:')
-    res = get_IDs_w_names()
-    print(" ID  First  Last")
-    print(' --  -----  ----')
-    for item in res:
-        print("{:3}: {} {}".format(*item))
+    """
+    Displays the index a page at a time.
+    Only the page being displayed is ever fetched.
+    """
+    page = get_index_page()
+    while True:
+        if not page:
+            print("No entries.")
+        else:
+            print(" ID  First  Last")
+            print(' --  -----  ----')
+            for row in helpfuncs.itabulate(page,
+                    display=lambda item: "{:3}: {} {}".format(*item),
+                    max_width=screen_width, separator='   ',
+                    width=max(len("{:3}: {} {}".format(*item))
+                              for item in page)):
+                print(row)
+        response = input(
+            "N)ext (default), P)revious, J)ump to letter, Q)uit .. ")
+        if not response or response[0] in 'nN':
+            if page:
+                new_page = get_index_page(
+                        key=(page[-1][3], page[-1][0]))
+            else:
+                new_page = get_index_page()
+            if not new_page:
+                print("End of index.")
+                continue
+        elif response[0] in 'pP':
+            if page:
+                new_page = get_index_page(
+                        key=(page[0][3], page[0][0]),
+                        backwards=True)
+            else:
+                new_page = get_index_page(backwards=True)
+            if not new_page:
+                print("Beginning of index.")
+                continue
+        elif response[0] in 'jJ':
+            letter = input("Letter: ").strip()[:1].lower()
+            new_page = get_index_page(key=(letter, 0))
+            if not new_page:  # past the end: show last page
+                new_page = get_index_page(backwards=True)
+        elif response[0] in 'qQ':
+            return
+        else:
+            continue
+        page = new_page
+
+
+def search(text, limit=20):
+    """
+    Returns a list of up to <limit> (personID, first, last,
+    company, town, email) tuples, best match first, of the
+    records containing (words beginning with) each of the
+    words in <text>. Searches the People_fts full text index
+    (first, last, company, town, email and extra fields.)
+    """
+    session = get_session()
+    session.ensure_schema()
+    terms = ['"{}"*'.format(term.replace('"', '""'))
+             for term in text.split()]
+    if not terms:
+        return []
+    query = """SELECT p.personID, p.first, p.last,
+            p.company, p.town, p.email
+        FROM People_fts JOIN People AS p
+            ON p.personID = People_fts.rowid
+        WHERE People_fts MATCH ?
+        ORDER BY rank LIMIT ?"""
+    return session.connection.execute(
+            query, (' '.join(terms), limit)).fetchall()
+
+
+def search_cmd():
+    while True:
+        text = input("Search for (blank to quit): ")
+        if not text:
+            return
+        res = search(text)
+        if not res:
+            print("No match.")
+        for item in res:
+            print("{:3}: {} {}  {}  {}  {}".format(*item))
 
 
 def get_values(peopleID):
-    con = sqlite3.connect(db_file_name)
-    cur = con.cursor()
-    query = "SELECT * FROM People WHERE personID = {}"
-    execute(cur, con, query.format(peopleID))
-    res = cur.fetchall()
-    return [item for item in res[0][1:]]
+    rec = get_record(peopleID)
+    # leave out derived columns
+    return [rec[key] for key in get_fieldnames()]
 
 
 def get_record(peopleID):
-    values = get_values(peopleID)
-    keys = get_fieldnames()
-#   _ = input(f'keys: {keys}')
-#   _ = input(f'values: {values}')
-    ret = dict()
-    for key, value in zip(keys, values):
-        ret[key] = value
-    return ret
+    """
+    Returns the record (a Contact, without personID) of
+    <peopleID> (None if there's no such record) using one
+    query, or none if it's in the session's record cache.
+    """
+    return get_session().record(peopleID)
 
 
 def display_row(id=None, display=False):
-    keys = [item[0] for item in get_IDs_w_names()]
     if id:
         peopleID = id
     else:
@@ -275,7 +1444,8 @@ def display_row(id=None, display=False):
             peopleID = input("Which contact to display? ")
             if not peopleID:
                 return
-            if int(peopleID) in keys:
+            # (a cached, or one indexed, look up: see get_record)
+            if get_record(peopleID) is not None:
                 break
     values = get_values(peopleID)
     ret = '|'.join(values)
@@ -293,7 +1463,7 @@ def get_letter_content(default=None):
         file_name = default
     else: 
         file_name = input("File with letter content: ")
-    with open(file_name, 'r') as instream:
+    with open_input(file_name) as instream:
         content = instream.read()
     return content
 
@@ -323,21 +1493,630 @@ def prepare_letter_cmd():
     print(letter)
 
 
+def select_records(where=None, ids=None):
+    """
+    A generator 'yield'ing People records (Contacts which,
+    unlike those returned by get_record, include personID.)
+    Which records is specified by either <where> (the text
+    of an SQL WHERE clause) or by <ids> (a sequence of
+    personIDs); if neither, all records are provided.
+    Records are in the order of <ids> (each only once) or
+    else of personID.
+    Rows are fetched fetch_batch_size at a time so memory
+    use doesn't depend on how many records are selected.
+    """
+    query = get_session().statement('select_records')
+    if ids is not None:
+        # one (reusable) statement whatever the number of ids
+        statement = get_session().statement('select_records_in')
+        seen = set()
+
+        def unique(ids):
+            for peopleID in ids:
+                if peopleID not in seen:
+                    seen.add(peopleID)
+                    yield peopleID
+
+        for chunk in helpfuncs.batches(unique(ids), fetch_batch_size):
+            cur = get_session().connection.cursor()
+            cur.row_factory = Contact
+            cur.execute(statement, (json.dumps(chunk), ))
+            yield from cur
+        return
+    if where:
+        query = f"{query} WHERE {where}"
+    cur = get_session().connection.cursor()
+    cur.row_factory = Contact
+    execute(cur, get_session().connection,
+            query + " ORDER BY personID")
+    while True:
+        rows = cur.fetchmany(fetch_batch_size)
+        if not rows:
+            break
+        yield from rows
+
+
+def get_segments(where=None, ids=None, n_segments=2):
+    """
+    Divides the records selected by <where> or <ids> (as for
+    select_records) into (up to) <n_segments> parts of about
+    the same number of records. Returns a list of (query,
+    params) tuples, in order, each selecting one part.
+    Unless <ids> are given, the parts are keyset ranges of
+    personID, the bounds of which are found using only the
+    primary key.
+    """
+    session = get_session()
+    if ids is not None:
+        ids = list(dict.fromkeys(ids))  # (as select_records)
+        size = max(1, -(-len(ids) // n_segments))  # rounding up
+        statement = session.statement('select_records_in')
+        return [(statement, (json.dumps(ids[i:i + size]), ))
+                for i in range(0, len(ids), size)]
+    where_clause = f" WHERE {where}" if where else ''
+    con = session.connection
+    count = con.execute("SELECT count(*) FROM People"
+                        + where_clause).fetchone()[0]
+    size = max(1, -(-count // n_segments))
+    # the upper bound of each range but the last
+    bounds = [row[0] for row in con.execute(f"""SELECT personID
+        FROM (SELECT personID,
+                row_number() OVER (ORDER BY personID) AS n
+            FROM People{where_clause})
+        WHERE n % ? = 0 AND n < ?""", (size, count))]
+    query = session.statement('select_records')
+    segments = []
+    lower = None
+    for upper in bounds + [None]:
+        conditions = []
+        params = []
+        if lower is not None:
+            conditions.append("personID > ?")
+            params.append(lower)
+        if upper is not None:
+            conditions.append("personID <= ?")
+            params.append(upper)
+        if where:
+            conditions.append(f"({where})")
+        segments.append((query
+            + (" WHERE " + " AND ".join(conditions) if conditions
+               else '')
+            + " ORDER BY personID", tuple(params)))
+        lower = upper
+    return segments
+
+
+def write_letters(recipients, letter_body, sender, lpr, sink,
+                  combined=False, formality=0, date=None):
+    """
+    Writes a letter to each of <recipients>: if <combined>,
+    all into the file <sink> ('-': standard output) separated
+    by form feeds; otherwise each into its own file
+    ('<personID>.txt') in the <sink> directory.
+    Returns the number of letters written.
+    """
+    layout = letters.get_layout(lpr)
+    n_letters = 0
+    if combined:
+        outstream = sys.stdout if sink == '-' else open(sink, 'w')
+    try:
+        for recipient in recipients:
+            if combined:
+                if n_letters:
+                    outstream.write(helpfuncs.FORMFEED)
+                layout.render_into(outstream, letter_body, recipient,
+                        sender, formality=formality, date=date)
+            else:
+                file_name = os.path.join(sink,
+                        "{}.txt".format(recipient['personID']))
+                with open(file_name, 'w') as letter_stream:
+                    layout.render_into(letter_stream, letter_body,
+                            recipient, sender,
+                            formality=formality, date=date)
+            n_letters += 1
+    finally:
+        if combined and outstream is not sys.stdout:
+            outstream.close()
+    return n_letters
+
+
+def render_segment(job):
+    """
+    Worker function (see mail_merge) which writes (see
+    write_letters) the letters of one segment (see
+    get_segments.) The records are read using the worker's
+    own (read only) connection to the data base.
+    Returns the number of letters written.
+    """
+    (db_file, query, params, letter_body, sender, lpr,
+     sink, combined, formality, date) = job
+    con = sqlite3.connect(
+            pathlib.Path(db_file).resolve().as_uri() + "?mode=ro",
+            uri=True)
+    try:
+        cur = con.cursor()
+        cur.row_factory = Contact
+        cur.execute(query, params)
+        return write_letters(cur, letter_body, sender, lpr, sink,
+                combined=combined, formality=formality, date=date)
+    finally:
+        con.close()
+
+
+def mail_merge(sender_id, letter_body, where=None, ids=None,
+               printer="X6505_e9", sink=None, combined=False,
+               formality=0, workers=1, report=True):
+    """
+    Prepares a letter (see letters.letter_text) from the
+    sender whose personID is <sender_id> to each of the
+    recipients selected by <where> or <ids> (see
+    select_records.)
+    If <combined>, all letters are written (separated by
+    form feeds) to the one file <sink> ('-': standard
+    output); otherwise each goes into its own file
+    ('<personID>.txt') in the <sink> directory (default:
+    mailing_dir.)
+    Recipients are streamed so memory use stays constant.
+    If <workers> is more than 1, the recipients are divided
+    (see get_segments) among that many processes each of
+    which reads and renders its own part; combined output
+    is written by each to a file of its own and these are
+    then joined, in order. (Not with an in_memory session
+    since other processes can't see its data base.)
+    Returns the number of letters written.
+    Raises ValueError (before any output is created) if
+    there's no record <sender_id>.
+    """
+    if sink is None:
+        sink = mailing_dir
+    session = get_session()
+    sender = get_record(sender_id)
+    if sender is None:
+        raise ValueError(f"No record {sender_id}")
+    lpr = letters.get_layout(printer)
+    date = helpfuncs.get_datestamp()
+    start = time.perf_counter()
+    if not combined:
+        os.makedirs(sink, exist_ok=True)
+    if workers <= 1 or session.in_memory:
+        n_letters = write_letters(select_records(where=where, ids=ids),
+                letter_body, sender, lpr, sink, combined=combined,
+                formality=formality, date=date)
+    else:
+        n_letters = 0
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            jobs = [(session.db_file, query, params, letter_body,
+                     sender, lpr,
+                     os.path.join(tmp_dir, f"{i}.txt") if combined
+                     else sink, combined, formality, date)
+                    for i, (query, params) in enumerate(
+                        get_segments(where, ids, workers))]
+            with multiprocessing.Pool(min(workers, len(jobs))) as pool:
+                counts = pool.map(render_segment, jobs)
+            if combined:  # join the segments
+                outstream = (sys.stdout if sink == '-'
+                             else open(sink, 'w'))
+                try:
+                    for job, count in zip(jobs, counts):
+                        if not count:
+                            continue
+                        if n_letters:
+                            outstream.write(helpfuncs.FORMFEED)
+                        with open(job[6], 'r') as instream:
+                            shutil.copyfileobj(instream, outstream)
+                        n_letters += count
+                finally:
+                    if outstream is not sys.stdout:
+                        outstream.close()
+            else:
+                n_letters = sum(counts)
+    elapsed = time.perf_counter() - start
+    if report:
+        print("Prepared {} letters in {:.2f} seconds ({:.0f} letters/sec)"
+              .format(n_letters, elapsed,
+                      n_letters / elapsed if elapsed else 0))
+    return n_letters
+
+
+def mail_merge_cmd():
+    """
+    Collects the parameters for and then runs mail_merge.
+    """
+    sender_id = get_record_id("sender")
+    if get_record(sender_id) is None:
+        print(f"No record {sender_id}")
+        return
+    try:
+        content = get_letter_content()
+    except OSError as error:
+        print(error)
+        return
+    where = ids = None
+    response = input(
+        "Recipients: A)ll, W)here clause, I)ds .. ")
+    if response and response[0] in 'wW':
+        where = input("WHERE ")
+    elif response and response[0] in 'iI':
+        try:
+            ids = [int(item) for item in
+                   input("Space separated IDs: ").split()]
+        except ValueError as error:
+            print(f"Not an ID: {error}")
+            return
+    elif not (response and response[0] in 'aA'):
+        return
+    combined = input(
+        "Combine letters into one file? (y/n) ")
+    combined = bool(combined and combined[0] in 'yY')
+    sink = input("Output {} (default: {}): ".format(
+        "file" if combined else "directory",
+        "Data/mailing.txt" if combined else mailing_dir))
+    if not sink:
+        sink = "Data/mailing.txt" if combined else mailing_dir
+    workers = input("Number of worker processes (default: 1): ")
+    try:
+        workers = int(workers) if workers else 1
+        mail_merge(sender_id, content, where=where, ids=ids,
+                   sink=sink, combined=combined, workers=workers)
+    except (ValueError, OSError, sqlite3.Error) as error:
+        print(f"Mail merge failed: {error}")
+
+
+def timing_cmd():
+    """
+    Turns on query timing or, if it's already on,
+    displays what's been collected so far.
+    """
+    if query_stats is None:
+        instrument_queries()
+        print("Query timing is on.")
+    else:
+        print_query_stats()
+
+
+def set_pragma_profile(profile):
+    """
+    Makes <profile> (a key of pragma_profiles) the one used
+    by the session's connections from now on.
+    """
+    global pragma_profile
+    pragma_profile = profile
+    for con in (_session._connection, ) if _session else ():
+        if con is not None and not con.in_transaction:
+            apply_pragmas(con, profile)
+
+
+profile_dir = None  # set (by --profile) to profile menu commands
+
+
+def run_cmd(cmd, *args, **kwargs):
+    """
+    Runs <cmd> (a menu command.) If <profile_dir> is set, it
+    is run under cProfile and tracemalloc and a report of its
+    time and memory use is written to a file in <profile_dir>
+    ('<n>-<command>.txt', along with the raw profile: '.prof'.)
+    <n> follows on from the reports already in <profile_dir>
+    so earlier runs' reports are kept.
+    """
+    if not profile_dir:
+        return cmd(*args, **kwargs)
+    os.makedirs(profile_dir, exist_ok=True)
+    n_profiled = max([int(match.group(1)) for match in
+                      map(re.compile(r'(\d+)-').match,
+                          os.listdir(profile_dir)) if match] + [0])
+    base_name = os.path.join(profile_dir,
+            "{:03}-{}".format(n_profiled + 1, cmd.__name__))
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        return profiler.runcall(cmd, *args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - start
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        profiler.dump_stats(base_name + '.prof')
+        with open(base_name + '.txt', 'w') as outstream:
+            outstream.write(
+                "{}: {:.3f} seconds (including time waiting for"
+                " input); memory: {:.1f} KiB at end, {:.1f} KiB peak\n\n"
+                .format(cmd.__name__, elapsed,
+                        current / 1024, peak / 1024))
+            stats = pstats.Stats(profiler, stream=outstream)
+            stats.sort_stats('cumulative').print_stats(30)
+            outstream.write("Largest allocations still held:\n")
+            for stat in snapshot.statistics('lineno')[:20]:
+                outstream.write(f"    {stat}\n")
+        print(f"Profile written to {base_name}.txt")
+
+
+# Batch (non interactive) commands: each takes the parsed command
+# line (see get_args), never prompts and returns an exit status.
+# Where a file name is expected '-' means standard input (or,
+# for render's combined output, standard output.)
+
+def read_ids(file_name, bad):
+    """
+    'yield's the (white space separated) personIDs
+    found in <file_name>. Anything else is reported (on
+    stderr), added to the list <bad> and skipped.
+    """
+    with open_input(file_name) as instream:
+        for line in instream:
+            for item in line.split():
+                try:
+                    yield int(item)
+                except ValueError:
+                    print(f"Not an ID: {item}", file=sys.stderr)
+                    bad.append(item)
+
+
+def batch_import(args):
+    """
+    Imports each of args.files (default: source_csv), in
+    "my csv" format or, with args.google, as exported by
+    google, first (if args.init) re-initializing the data base.
+    """
+    if args.init:
+        con = initiate_db()
+    else:
+        get_session().ensure_schema()
+        con = get_session().connection
+    for csv_file in args.files or [source_csv]:
+        if args.google:
+            ingest_google(con, csv_file, workers=args.workers)
+        else:
+            bulk_import(con, csv_file)
+    return 0
+
+
+def batch_sync(args):
+    get_session().ensure_schema()
+    sync(get_session().connection, args.file)
+    return 0
+
+
+def batch_search(args):
+    """
+    Searches for args.text or, if none was given, for each
+    line of standard input in which case each result line
+    begins with the line searched for. Results are tab
+    separated.
+    """
+    if args.text:
+        texts = [' '.join(args.text)]
+    else:
+        texts = (line.strip() for line in sys.stdin)
+    for text in texts:
+        prefix = '' if args.text else text + '\t'
+        for item in search(text, limit=args.limit):
+            print(prefix + '\t'.join(str(value) for value in item))
+    return 0
+
+
+def batch_show(args):
+    """
+    Prints (as display_row does) the record of each of
+    args.ids or, if none, of the IDs read from standard input.
+    Returns 1 if any were not found (or not IDs.)
+    """
+    status = 0
+    bad = []
+    for peopleID in args.ids or read_ids('-', bad):
+        if get_record(peopleID) is None:
+            print(f"No record {peopleID}", file=sys.stderr)
+            status = 1
+            continue
+        print('|'.join(get_values(peopleID)))
+    return 1 if bad else status
+
+
+def get_selection(args, bad):
+    """
+    Returns a (where, ids) tuple as expected by
+    select_records from args.where/ids/ids_from.
+    Anything in args.ids_from which isn't an ID is added
+    to the list <bad> (see read_ids.)
+    """
+    ids = None
+    if args.ids:
+        ids = args.ids
+    elif args.ids_from:
+        ids = read_ids(args.ids_from, bad)
+    return args.where, ids
+
+
+def batch_render(args):
+    bad = []
+    where, ids = get_selection(args, bad)
+    combined = args.combined is not None
+    try:
+        mail_merge(args.sender, get_letter_content(args.letter),
+                   where=where, ids=ids, printer=args.printer,
+                   sink=args.combined if combined else args.out,
+                   combined=combined, formality=args.formality,
+                   workers=args.workers,
+                   report=args.combined != '-')
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    return 1 if bad else 0
+
+
+def batch_export(args):
+    """
+    Writes the selected records (all fields but the
+    derived ones) as csv to args.output (default:
+    standard output.)
+    """
+    fieldnames = get_fieldnames(includeID=True)
+    bad = []
+    where, ids = get_selection(args, bad)
+    outstream = (open(args.output, 'w', newline='')
+                 if args.output else sys.stdout)
+    try:
+        writer = csv.writer(outstream)
+        writer.writerow(fieldnames)
+        for record in select_records(where=where, ids=ids):
+            writer.writerow([record[key] for key in fieldnames])
+    finally:
+        if outstream is not sys.stdout:
+            outstream.close()
+    return 1 if bad else 0
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+            description="Manage data base for a letter writing app."
+                        " Without a command the interactive menu"
+                        " is used.")
+    parser.add_argument('--profile', metavar='DIR',
+            help="write time and memory reports of each"
+                 " command to DIR")
+    parser.add_argument('--pragmas', choices=pragma_profiles,
+            default=pragma_profile,
+            help="connection settings (default: %(default)s)")
+    parser.add_argument('--in-memory', action='store_true',
+            help="work on a copy of the data base held in memory"
+                 " which is written back to disk from time to"
+                 " time and on quitting; this replaces the whole"
+                 " file so is refused if another process has"
+                 " changed it meanwhile (on quitting the copy is"
+                 " then saved to <data base>.unsaved)")
+    parser.add_argument('--flush-every', type=float,
+            default=flush_interval, metavar='SECONDS',
+            help="with --in-memory: how often (between commands)"
+                 " changes are written to disk"
+                 " (default: %(default)s)")
+    commands = parser.add_subparsers(dest='command',
+            metavar='command')
+
+    def add_selection(command):
+        group = command.add_mutually_exclusive_group()
+        group.add_argument('--where',
+                help="text of an SQL WHERE clause")
+        group.add_argument('--ids', type=int, nargs='+',
+                metavar='ID')
+        group.add_argument('--ids-from', metavar='FILE',
+                help="file of white space separated IDs"
+                     " ('-': standard input)")
+
+    command = commands.add_parser('import',
+            help="add records from csv files")
+    command.add_argument('files', nargs='*', metavar='FILE',
+            help=f"'-': standard input (default: {source_csv})")
+    command.add_argument('--init', action='store_true',
+            help="first re-initialize the data base")
+    command.add_argument('--google', action='store_true',
+            help="the files are google contacts exports")
+    command.add_argument('-w', '--workers', type=int, default=1,
+            help="with --google: processes converting rows")
+    command.set_defaults(func=batch_import)
+
+    command = commands.add_parser('sync',
+            help="bring the data base up to date with a csv file"
+                 " (records not in it are deleted)")
+    command.add_argument('file', nargs='?', default=source_csv,
+            help="'-': standard input (default: %(default)s)")
+    command.set_defaults(func=batch_sync)
+
+    command = commands.add_parser('search',
+            help="full text search (tab separated results)")
+    command.add_argument('text', nargs='*',
+            help="words to search for (default: search for"
+                 " each line of standard input)")
+    command.add_argument('-l', '--limit', type=int, default=20)
+    command.set_defaults(func=batch_search)
+
+    command = commands.add_parser('show',
+            help="print records ('|' separated fields)")
+    command.add_argument('ids', type=int, nargs='*', metavar='ID',
+            help="(default: IDs read from standard input)")
+    command.set_defaults(func=batch_show)
+
+    command = commands.add_parser('render',
+            help="mail merge a letter to the selected records"
+                 " (default: all)")
+    command.add_argument('sender', type=int, metavar='SENDER_ID')
+    command.add_argument('letter', metavar='LETTER',
+            help="file with the letter's content"
+                 " ('-': standard input)")
+    add_selection(command)
+    output = command.add_mutually_exclusive_group()
+    output.add_argument('-o', '--out', default=mailing_dir,
+            metavar='DIR', help="directory for the letters"
+                                " (default: %(default)s)")
+    output.add_argument('-c', '--combined', metavar='FILE',
+            help="write all letters to FILE ('-': standard output)")
+    command.add_argument('-p', '--printer', default='X6505_e9',
+            choices=letters.printers)
+    command.add_argument('-f', '--formality', type=int, default=0)
+    command.add_argument('-w', '--workers', type=int, default=1)
+    command.set_defaults(func=batch_render)
+
+    command = commands.add_parser('export',
+            help="write the selected records (default: all)"
+                 " as csv")
+    add_selection(command)
+    command.add_argument('-o', '--output', metavar='FILE',
+            help="(default: standard output)")
+    command.set_defaults(func=batch_export)
+
+    args = parser.parse_args()
+    if (args.command == 'import' and args.google
+            and '-' in args.files):
+        parser.error("google exports can't be read from"
+                     " standard input")
+    return args
+
+
 def main():
-    menu = '\nI)initiate K)eys D)isplay A)dd L)etter Q)uit..'
+    global profile_dir, in_memory, flush_interval
+    args = get_args()
+    profile_dir = args.profile
+    in_memory = args.in_memory
+    flush_interval = args.flush_every
+    set_pragma_profile(args.pragmas)
+    if os.environ.get('LETTER_QUERY_STATS'):
+        instrument_queries()
+    if args.command:
+        try:
+            status = run_cmd(args.func, args)
+            sys.stdout.flush()
+        except BrokenPipeError:  # eg piped into head
+            # (keep the interpreter from complaining at exit)
+            os.dup2(os.open(os.devnull, os.O_WRONLY),
+                    sys.stdout.fileno())
+            status = 1
+        sys.exit(status)
+    menu = ('\nI)initiate R)efresh G)oogle K)eys S)earch D)isplay'
+            ' A)dd L)etter M)erge T)iming Q)uit..')
     while True:
+        if _session is not None:
+            _session.maybe_flush()
         response = input(menu) 
         if response:
             if response[0] in 'iI':
-                initiate_db_cmd()
+                run_cmd(initiate_db_cmd)
+            elif response[0] in 'rR':
+                run_cmd(sync_cmd)
+            elif response[0] in 'gG':
+                run_cmd(ingest_google_cmd)
             elif response[0] in 'kK':
-                show_index()
+                run_cmd(show_index)
+            elif response[0] in 'sS':
+                run_cmd(search_cmd)
             elif response[0] in 'dD':
-                display_row(display=True)
+                run_cmd(display_row, display=True)
             elif response[0] in 'aA':
-                add_cmd()
+                run_cmd(add_cmd)
             elif response[0] in 'lL':
-                prepare_letter_cmd()
+                run_cmd(prepare_letter_cmd)
+            elif response[0] in 'mM':
+                run_cmd(mail_merge_cmd)
+            elif response[0] in 'tT':
+                timing_cmd()
             elif response[0] in 'qQ':
                 sys.exit()
             else:
@@ -346,4 +2125,3 @@ def main():
 
 if __name__ == '__main__':
     main()
-
@@ -4,17 +4,35 @@
 
 """
 Usage:
-    ./merge2csv.py fieldnames csv1 csv2 new_csv
+    ./merge2csv.py [-v] [-s [-m MB]] fieldnames csv1 csv2 new_csv
+    ./merge2csv.py -n [-v] [-r report] fieldnames csv1 csv2 [csv3 ..] new_csv
 
 Args:
     fieldnames: a >=1 line file containing a comma
         separated listing of all field names needed.
-    csv1:  }  two csv files to
+    csv1:  }  two (or with -n, any number of) csv files to
     csv2:  }  combine into ...
     new_csv
 
+Options:
+    -v  Print the key of each record as it's written.
+    -s  Stream: sort each file (in chunks, using temporary
+        files) and then merge them so that memory use does
+        not depend on the size of the files. Records in
+        <new_csv> are then in order of their "last,first" key.
+    -m MB  Approximate limit on memory used by each sorted
+        chunk when streaming. [default: 64]
+    -n  N-way: merge all the csv files in one pass, field by
+        field: records are matched by a normalized (case and
+        white space insensitive) "last,first" key and each field
+        gets the last non-empty value found, so list the files
+        oldest first. Records stay in order of first appearance.
+    -r report  With -n: write a csv listing each non-empty
+        value which differs (other than in case or white space)
+        from the one kept for its field.
+
 We assume that 1. keys "first" and "last" appear in ...
-and 2. fields specified in <fieldnames> includes 
+and 2. fields specified in <fieldnames> includes
 all field names of ...             both csv1 and csv2.
 <new_csv> will contain records of both csv1 and csv2
 with added keys as necessary so that all keys specified
@@ -23,14 +41,33 @@ NOTE: The order in which the two csv files are specified matters!
 The content of the second takes precedence.
 """
 
+import os
 import sys
 import csv
+import heapq
+import argparse
+import itertools
+import tempfile
 
-args = sys.argv
 
-if len(args) != 5:
-    print(__doc__)
-    sys.exit()
+def get_args():
+    parser = argparse.ArgumentParser(usage=__doc__,
+                                     add_help=False)
+    parser.add_argument('-v', action='store_true')
+    parser.add_argument('-s', action='store_true')
+    parser.add_argument('-m', type=float, default=64)
+    parser.add_argument('-n', action='store_true')
+    parser.add_argument('-r')
+    parser.add_argument('fieldnames')
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args()
+    if (len(args.files) < 3
+            or (len(args.files) != 3 and not args.n)):
+        print(__doc__)
+        sys.exit()
+    args.csv_files = args.files[:-1]
+    args.new_csv = args.files[-1]
+    return args
 
 
 def get_new_keys(key_file):
@@ -48,6 +85,18 @@ def get_new_keys(key_file):
     return collector
 
 
+def get_name_key(row):
+    return f"{row['last']},{row['first']}"
+
+
+def normalized(value):
+    return ' '.join(value.split()).lower()
+
+
+def get_normalized_key(row):
+    return "{},{}".format(normalized(row['last']),
+                          normalized(row['first']))
+
 
 def collect_dict(csv_file, new_keys):
     """
@@ -60,7 +109,7 @@ def collect_dict(csv_file, new_keys):
         reader = csv.DictReader(instream)
         keys_in_row = reader.fieldnames
         for row in reader:
-            name_key = f"{row['last']},{row['first']}"
+            name_key = get_name_key(row)
             values = dict()
             for key in new_keys:
                 if key in keys_in_row:
@@ -71,25 +120,183 @@ def collect_dict(csv_file, new_keys):
     return collector
 
 
-def populate_csv_file(file_name, fieldnames, dict_of_records):
+def populate_csv_file(file_name, fieldnames, dict_of_records,
+                      verbose=False):
     with open(file_name, 'w', newline='') as outstream:
         writer = csv.DictWriter(outstream,
                 fieldnames=fieldnames)
         writer.writeheader()
         for key in dict_of_records.keys():
-            print(key)
+            if verbose:
+                print(key)
             writer.writerow(dict_of_records[key])
 
 
+def sorted_runs(csv_file, new_keys, max_bytes, tmp_dir):
+    """
+    Reads <csv_file> in chunks of (approximately) no more
+    than <max_bytes> and writes each, sorted by name key
+    (and then order of appearance,) to a file in <tmp_dir>.
+    Each row of these 'run' files is: the key, the record's
+    position in <csv_file>, then its values (in the order
+    of <new_keys>.) Returns a list of the run file names.
+    """
+    runs = []
+
+    def write_run(chunk):
+        chunk.sort()
+        run_name = os.path.join(tmp_dir,
+                "{}.{}".format(os.path.basename(csv_file),
+                               len(runs)))
+        with open(run_name, 'w', newline='') as outstream:
+            writer = csv.writer(outstream)
+            writer.writerows(chunk)
+        runs.append(run_name)
+
+    chunk = []
+    chunk_size = 0
+    with open(csv_file, 'r', newline='') as instream:
+        reader = csv.DictReader(instream)
+        keys_in_row = reader.fieldnames
+        for position, row in enumerate(reader):
+            values = [row[key] if key in keys_in_row else ''
+                      for key in new_keys]
+            chunk.append([get_name_key(row), position] + values)
+            # rough size of the list and its strings
+            chunk_size += (sum(len(value) for value in values)
+                           + 60 * (len(values) + 3))
+            if chunk_size >= max_bytes:
+                write_run(chunk)
+                chunk = []
+                chunk_size = 0
+    if chunk or not runs:
+        write_run(chunk)
+    return runs
+
+
+def read_run(run_name, source):
+    """
+    'yield's (key, source, position, values) tuples from a
+    file written by sorted_runs.
+    """
+    with open(run_name, 'r', newline='') as instream:
+        for row in csv.reader(instream):
+            yield (row[0], source, int(row[1]), row[2:])
+
+
+def stream_merge(csv_files, new_keys, new_csv,
+                 max_memory=64, verbose=False):
+    """
+    Does what main does with collect_dict and populate_csv_file
+    but without ever holding more than about <max_memory> (MB)
+    of records: each of <csv_files> is sorted (see sorted_runs)
+    and all the runs are then merged. Where a key appears more
+    than once, the record from the later file (or the later in
+    the same file) takes precedence.
+    Records are written in order of their name key.
+    Returns the number of records written.
+    """
+    max_bytes = int(max_memory * 1024 * 1024)
+    n_written = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        streams = []
+        for source, csv_file in enumerate(csv_files):
+            for run_name in sorted_runs(csv_file, new_keys,
+                                        max_bytes, tmp_dir):
+                streams.append(read_run(run_name, source))
+        with open(new_csv, 'w', newline='') as outstream:
+            writer = csv.writer(outstream)
+            writer.writerow(new_keys)
+            for key, group in itertools.groupby(
+                    heapq.merge(*streams), key=lambda item: item[0]):
+                for item in group:  # the last one takes precedence
+                    pass
+                if verbose:
+                    print(key)
+                writer.writerow(item[3])
+                n_written += 1
+    return n_written
+
+
+def nway_merge(csv_files, new_keys, new_csv, report=None,
+               verbose=False):
+    """
+    Merges any number of <csv_files> into <new_csv>, reading
+    each file once. Records are matched by (a hash index on)
+    their normalized name key and merged field by field: a
+    field takes the value from the last file in which it is
+    non-empty. For each non-empty value which was replaced
+    and which differs (other than in case or white space, as
+    with keys) from the value written, a line is added to the
+    <report> csv file (if specified.)
+    Returns a tuple: (n records written, n conflicts.)
+    """
+    merged = dict()   # normalized key: list of values
+    origins = dict()  # normalized key: list of source files
+    replaced = dict()  # (key, field index): [(value, source), ..]
+    for csv_file in csv_files:
+        with open(csv_file, 'r', newline='') as instream:
+            reader = csv.DictReader(instream)
+            keys_in_row = reader.fieldnames
+            present = [(i, key) for i, key in enumerate(new_keys)
+                       if key in keys_in_row]
+            for row in reader:
+                name_key = get_normalized_key(row)
+                values = merged.get(name_key)
+                if values is None:
+                    values = [''] * len(new_keys)
+                    merged[name_key] = values
+                    origins[name_key] = [None] * len(new_keys)
+                sources = origins[name_key]
+                for i, key in present:
+                    value = row[key]
+                    if not value:
+                        continue
+                    if (values[i] and normalized(values[i])
+                                      != normalized(value)):
+                        replaced.setdefault((name_key, i), []).append(
+                                (values[i], sources[i]))
+                    values[i] = value
+                    sources[i] = csv_file
+    conflicts = []  # compared with the values written
+    for (name_key, i), superseded in replaced.items():
+        kept = merged[name_key][i]
+        for value, source in superseded:
+            if normalized(value) != normalized(kept):
+                conflicts.append((name_key, new_keys[i],
+                        kept, origins[name_key][i], value, source))
+    with open(new_csv, 'w', newline='') as outstream:
+        writer = csv.writer(outstream)
+        writer.writerow(new_keys)
+        for name_key, values in merged.items():
+            if verbose:
+                print(name_key)
+            writer.writerow(values)
+    if report:
+        with open(report, 'w', newline='') as outstream:
+            writer = csv.writer(outstream)
+            writer.writerow(('key', 'field', 'kept', 'kept_from',
+                             'replaced', 'replaced_from'))
+            writer.writerows(conflicts)
+    return len(merged), len(conflicts)
+
+
 def main():
-    new_keys = get_new_keys(args[1])
+    args = get_args()
+    new_keys = get_new_keys(args.fieldnames)
 #   print(new_keys)
-    csv1 = args[2]
-    csv2 = args[3]
-    new_csv = args[4]
-    for file_name in (csv1, csv2, new_csv, ):
-#       print(file_name)
-        pass
+    new_csv = args.new_csv
+    if args.n:
+        n_records, n_conflicts = nway_merge(args.csv_files,
+                new_keys, new_csv, report=args.r, verbose=args.v)
+        print("{} records written to {}; {} conflicting values."
+              .format(n_records, new_csv, n_conflicts))
+        return
+    csv1, csv2 = args.csv_files
+    if args.s:
+        stream_merge((csv1, csv2), new_keys, new_csv,
+                     max_memory=args.m, verbose=args.v)
+        return
     d1 = collect_dict(csv1, new_keys)
     d2 = collect_dict(csv2, new_keys)
     new_dict = dict()
@@ -97,7 +304,7 @@ def main():
         new_dict[key] = d1[key]
     for key in d2.keys():
         new_dict[key] = d2[key]
-    populate_csv_file(new_csv, new_keys, new_dict)
+    populate_csv_file(new_csv, new_keys, new_dict, verbose=args.v)
 
 
 if __name__ == '__main__':